@@ -1,15 +1,6 @@
 from pathlib import Path
 import uuid
 
-from blurprints.member_blueprint import member_blueprint
-from blurprints.image_blueprint import image_blueprint
-from blurprints.activity_blueprint import activity_blueprint
-from blurprints.paper_blueprint import paper_blueprint
-from blurprints.project_blueprint import project_blueprint
-from blurprints.retrieval_blueprint import retrieval_blueprint
-from blurprints.news_blueprint import news_blueprint
-from blurprints.auth_blueprint import auth_blueprint
-
 from config import Config
 from models.database import db
 
@@ -20,6 +11,17 @@ from flask_jwt_extended import JWTManager
 
 
 def create_app():
+    # the blueprints set up the retrieval index and its background jobs, so they are
+    # only imported here: the spawned pdf workers import this module as __mp_main__
+    from blurprints.member_blueprint import member_blueprint
+    from blurprints.image_blueprint import image_blueprint
+    from blurprints.activity_blueprint import activity_blueprint
+    from blurprints.paper_blueprint import paper_blueprint
+    from blurprints.project_blueprint import project_blueprint
+    from blurprints.retrieval_blueprint import retrieval_blueprint
+    from blurprints.news_blueprint import news_blueprint
+    from blurprints.auth_blueprint import auth_blueprint
+
     app = Flask(__name__)
     app.secret_key = uuid.uuid4().hex
     app.config.from_object(Config)
@@ -52,9 +54,8 @@ def create_app():
     return app
 
 
-app = create_app()
-
 if __name__ == '__main__':
+    app = create_app()
     Path('statics/images').mkdir(parents=True, exist_ok=True)
     Path('statics/attachments').mkdir(parents=True, exist_ok=True)
     app.run(host=app.config['HOST'], port=app.config['PORT'])
@@ -1,11 +1,11 @@
 import os
+import json
 import time
-import requests
+import fcntl
 import threading
-from queue import Queue
+from queue import Empty, Queue
+from pathlib import Path
 from datetime import datetime
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
 
 from google.api.resource_pb2 import resource
 
@@ -13,12 +13,13 @@ from config import Config
 
 from fastapi.openapi.models import APIKey
 from langchain_openai import ChatOpenAI
-from langchain_community.vectorstores import Chroma
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_community.callbacks import get_openai_callback
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import messages_from_dict
 from langchain_community.embeddings import OpenAIEmbeddings
-from langchain.memory import ConversationBufferWindowMemory
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from langchain_community.document_loaders import AsyncHtmlLoader
+from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryBufferMemory
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_transformers import MarkdownifyTransformer
 
@@ -26,6 +27,22 @@ from flask import Blueprint, request, stream_with_context, current_app
 from flask import Response as FlaskResponse
 
 from models.responses import Response
+from utiles.answer_cache import SemanticAnswerCache
+from utiles.checkpoint import CrawlCheckpoint, SourceTracker
+from utiles.condense import is_standalone_question
+from utiles.crawler import crawl_website
+from utiles.embedding_cache import CachedEmbeddings
+from utiles.dedup import MinHashDeduplicator
+from utiles.db_documents import DatabaseSync, build_documents
+from utiles.index_store import BlueGreenIndex
+from utiles.keyword_index import BM25Index, KeywordRetriever
+from utiles.llm_pool import LlmWorkerPool, PoolSaturated, PoolTimeout
+from utiles.local_embeddings import HashingEmbeddings, OnnxEmbeddings
+from utiles.memory_store import SessionStore, SqlSessionBackend
+from utiles.page_cache import PageCache
+from utiles.pdf_extractor import AttachmentExtractor
+from utiles.pipeline import Batcher, run_pipeline
+from utiles.progress import CrawlProgress
 
 retrieval_blueprint = Blueprint('retrieval', __name__)
 
@@ -34,141 +51,516 @@ scrapying_status = {
     'start_time': '',
     'end_time': ''
 }
-embedding = OpenAIEmbeddings(model='text-embedding-3-small', openai_api_key=Config.OPENAI_KEY)
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, api_key=Config.OPENAI_KEY)
+crawl_progress = CrawlProgress()
+
+
+def build_embedding():
+    # the name keys the embedding cache and tags each collection, so vectors of
+    # different backends are never mixed
+    if Config.EMBEDDING_BACKEND == 'onnx':
+        return OnnxEmbeddings(
+            Config.EMBEDDING_ONNX_MODEL_PATH,
+            Config.EMBEDDING_ONNX_TOKENIZER_PATH,
+            batch_size=Config.EMBEDDING_LOCAL_BATCH_SIZE
+        ), f"onnx:{Config.EMBEDDING_ONNX_MODEL_PATH}"
+    if Config.EMBEDDING_BACKEND == 'hashing':
+        return HashingEmbeddings(Config.EMBEDDING_HASHING_FEATURES), f"hashing:{Config.EMBEDDING_HASHING_FEATURES}"
+    return OpenAIEmbeddings(model=Config.EMBEDDING_MODEL, openai_api_key=Config.OPENAI_KEY), Config.EMBEDDING_MODEL
+
+
+embedding_backend, embedding_name = build_embedding()
+embedding = CachedEmbeddings(
+    embedding_backend,
+    embedding_name,
+    Config.EMBEDDING_CACHE_PATH,
+    batch_size=Config.EMBEDDING_BATCH_SIZE
+)
+# retries are left to llm_pool, which backs off with jitter instead of retrying in lockstep
+llm = ChatOpenAI(
+    model_name="gpt-3.5-turbo", temperature=0, api_key=Config.OPENAI_KEY, timeout=Config.LLM_TIMEOUT, max_retries=0
+)
+streaming_llm = ChatOpenAI(
+    model_name="gpt-3.5-turbo", temperature=0, api_key=Config.OPENAI_KEY, timeout=Config.LLM_TIMEOUT, max_retries=0,
+    streaming=True
+)
+llm_pool = LlmWorkerPool(
+    max_workers=Config.LLM_WORKERS,
+    max_queue=Config.LLM_QUEUE_SIZE,
+    timeout=Config.LLM_REQUEST_TIMEOUT,
+    max_retries=Config.LLM_MAX_RETRIES
+)
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    def __init__(self):
+        self.queue = Queue()
+        self.streamed = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.streamed = True
+        self.queue.put(token)
+
+
+class UserSession:
+    def __init__(self, memory):
+        self.memory = memory
+        self.version = 0
 
 
 class UserMemoryManager:
-    def __init__(self, retriever, llm, memory_window=5, inactive_time=36):
+    def __init__(
+            self, retriever, llm, condense_llm=None, answer_cache=None, session_backend=None, memory_mode='window',
+            memory_window=5, memory_token_budget=1000, inactive_time=36, max_users=1000, max_tokens=2000000
+    ):
         self.retriever = retriever
         self.llm = llm
+        self.condense_llm = condense_llm
+        self.answer_cache = answer_cache
+        self.session_backend = session_backend
+        self.memory_mode = memory_mode
         self.memory_window = memory_window
+        self.memory_token_budget = memory_token_budget
         self.inactive_time = inactive_time
-        self.user_memories = {}
-        self.last_activity = {}
-        self.lock = threading.Lock()
-
-    def get_chain_for_user(self, user_id):
-        with self.lock:
-            if user_id not in self.user_memories:
-                memory = ConversationBufferWindowMemory(
-                    memory_key="chat_history",
-                    return_messages=True,
-                    output_key='answer'
-                )
-                self.user_memories[user_id] = memory
-            else:
-                memory = self.user_memories[user_id]
-
-            self.last_activity[user_id] = datetime.now()
+        self.max_users = max_users
+        self.sessions = SessionStore(
+            self.new_session, ttl=inactive_time, max_sessions=max_users, max_tokens=max_tokens
+        )
+        self.chain = self.build_chain(retriever)
+        self.metrics_lock = threading.Lock()
+        self.condense_metrics = {
+            'condensed': 0, 'skipped': 0, 'total_seconds': 0.0, 'total_tokens': 0, 'total_cost': 0.0
+        }
+
+    def build_chain(self, retriever):
+        return ConversationalRetrievalChain.from_llm(
+            llm=self.llm,
+            retriever=retriever,
+            condense_question_llm=self.condense_llm,
+            return_source_documents=True,
+        )
+
+    def set_retriever(self, retriever):
+        self.chain = self.build_chain(retriever)
+        self.retriever = retriever
 
-            return ConversationalRetrievalChain.from_llm(
-                llm=self.llm,
-                retriever=self.retriever,
-                memory=memory,
-                return_source_documents=True,
+    def new_session(self):
+        if self.memory_mode == 'summary':
+            return UserSession(ConversationSummaryBufferMemory(
+                llm=self.condense_llm or self.llm,
+                max_token_limit=self.memory_token_budget,
+                memory_key="chat_history",
+                return_messages=True,
+                output_key='answer'
+            ))
+        return UserSession(ConversationBufferWindowMemory(
+            k=self.memory_window,
+            memory_key="chat_history",
+            return_messages=True,
+            output_key='answer'
+        ))
+
+    def get_session_for_user(self, user_id):
+        session = self.sessions.get(user_id)
+        if self.session_backend is None:
+            return session
+
+        stored = self.session_backend.load_if_newer(user_id, session.version)
+        if stored is not None:
+            session.version, history = stored
+            session.memory.chat_memory.messages = messages_from_dict([
+                {'type': message_type, 'data': {'content': content}} for message_type, content in history['messages']
+            ])
+            if self.memory_mode == 'summary':
+                session.memory.moving_summary_buffer = history['summary']
+        return session
+
+    def get_memory_for_user(self, user_id):
+        return self.get_session_for_user(user_id).memory
+
+    def chat(self, user_id, question, callbacks=None):
+        session = self.get_session_for_user(user_id)
+        memory = session.memory
+        chat_history = memory.load_memory_variables({})['chat_history']
+
+        use_answer_cache = self.answer_cache is not None and not chat_history
+        result = self.lookup_answer_cache(question) if use_answer_cache else None
+        if result is not None:
+            result = {**result, 'cached': True}
+        else:
+            standalone_question = self.condense_question(question, chat_history)
+            result = self.chain.invoke(
+                {'question': standalone_question, 'chat_history': []},
+                config={'callbacks': callbacks}
             )
+            if use_answer_cache:
+                self.store_answer_cache(question, result)
+
+        memory.save_context({'question': question}, {'answer': result['answer']})
+        messages = memory.chat_memory.messages
+        summary = ''
+        if self.memory_mode == 'summary':
+            summary = memory.moving_summary_buffer
+        else:
+            del messages[:-2 * self.memory_window]
+        self.sessions.resize(user_id, [summary] + [message.content for message in messages])
+
+        if self.session_backend is not None:
+            session.version += 1
+            self.session_backend.save(user_id, session.version, {
+                'summary': summary,
+                'messages': [[message.type, message.content] for message in messages]
+            })
+        return result
+
+    def lookup_answer_cache(self, question):
+        # the answer cache needs the embedding API, which must not take the chatbot down with it
+        try:
+            return self.answer_cache.get(question)
+        except Exception as e:
+            print(e)
+            return None
+
+    def store_answer_cache(self, question, result):
+        try:
+            self.answer_cache.put(question, {
+                'answer': result['answer'], 'source_documents': result['source_documents']
+            })
+        except Exception as e:
+            print(e)
+
+    def condense_question(self, question, chat_history):
+        if not chat_history or is_standalone_question(question):
+            with self.metrics_lock:
+                self.condense_metrics['skipped'] += 1
+            return question
+
+        start_time = time.perf_counter()
+        with get_openai_callback() as usage:
+            standalone_question = self.chain.question_generator.invoke({
+                'question': question, 'chat_history': _get_chat_history(chat_history)
+            })['text']
+        elapsed = time.perf_counter() - start_time
+
+        with self.metrics_lock:
+            self.condense_metrics['condensed'] += 1
+            self.condense_metrics['total_seconds'] += elapsed
+            self.condense_metrics['total_tokens'] += usage.total_tokens
+            self.condense_metrics['total_cost'] += usage.total_cost
+        return standalone_question
+
+    def get_condense_metrics(self):
+        with self.metrics_lock:
+            metrics = dict(self.condense_metrics)
+        metrics['average_seconds'] = metrics['total_seconds'] / metrics['condensed'] if metrics['condensed'] else 0
+        return metrics
 
     def clean_inactive_memories(self):
-        with self.lock:
-            current_time = datetime.now()
-            inactive_users = [
-                user_id for user_id, last_active in self.last_activity.items()
-                if (current_time - last_active).total_seconds() > self.inactive_time
-            ]
-            for user_id in inactive_users:
-                del self.user_memories[user_id]
-                del self.last_activity[user_id]
-            return len(inactive_users)
-
-
-manager = None
-
-
-def process_url(url, root_url, visited_urls, html_urls, next_queue):
-    if url in visited_urls:
+        return self.sessions.expire()
+
+
+def build_session_backend():
+    if Config.RETRIEVAL_SESSION_BACKEND == 'database':
+        url = Config.SQLALCHEMY_DATABASE_URI
+    elif Config.RETRIEVAL_SESSION_BACKEND == 'sqlite':
+        Path(Config.RETRIEVAL_SESSION_SQLITE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        url = f"sqlite:///{Config.RETRIEVAL_SESSION_SQLITE_PATH}"
+    else:
+        return None
+    return SqlSessionBackend(url, flush_interval=Config.RETRIEVAL_SESSION_FLUSH_INTERVAL)
+
+
+index = BlueGreenIndex(
+    Config.RETRIEVAL_PERSIST_DIRECTORY,
+    embedding,
+    embedding_name=embedding_name,
+    backend=Config.VECTOR_STORE_BACKEND,
+    dtype=Config.VECTOR_STORE_DTYPE
+)
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=128)
+attachments = AttachmentExtractor(Config.ATTACHMENT_CACHE_PATH, max_workers=Config.ATTACHMENT_WORKERS)
+page_cache = PageCache(Config.CRAWLER_PAGE_CACHE_PATH)
+crawl_checkpoint = CrawlCheckpoint(Config.CRAWL_CHECKPOINT_PATH)
+session_backend = build_session_backend()
+answer_cache = SemanticAnswerCache(
+    embedding,
+    threshold=Config.ANSWER_CACHE_THRESHOLD,
+    ttl=Config.ANSWER_CACHE_TTL,
+    max_size=Config.ANSWER_CACHE_SIZE
+)
+database_sync = DatabaseSync(
+    index, text_splitter, attachments, interval=Config.DATABASE_SYNC_INTERVAL, on_change=answer_cache.clear
+)
+
+
+def build_manager(retriever):
+    return UserMemoryManager(
+        retriever, streaming_llm, condense_llm=llm, answer_cache=answer_cache, session_backend=session_backend,
+        memory_mode=Config.RETRIEVAL_MEMORY_MODE, memory_token_budget=Config.RETRIEVAL_MEMORY_TOKEN_BUDGET,
+        inactive_time=Config.RETRIEVAL_INACTIVE_TIME, max_users=Config.RETRIEVAL_MAX_USERS,
+        max_tokens=Config.RETRIEVAL_MAX_MEMORY_TOKENS
+    )
+
+
+def serve_retriever(retriever, mode):
+    global manager, serving_mode
+    with serving_lock:
+        if manager is None:
+            manager = build_manager(retriever)
+        else:
+            manager.set_retriever(retriever)
+        answer_cache.clear()
+        serving_mode = mode
+
+
+def serve_active_index():
+    serve_retriever(
+        index.active.as_retriever(k=Config.RETRIEVAL_TOP_K, keyword_weight=Config.RETRIEVAL_KEYWORD_WEIGHT),
+        'vector'
+    )
+
+
+def serve_keyword_fallback():
+    # until a vector index built with the configured embedding exists, answer from a
+    # keyword index over the lab's own database rows, rebuilt every KEYWORD_FALLBACK_REFRESH seconds
+    global keyword_fallback_built_at
+    if keyword_fallback_is_fresh():
         return
 
-    with visited_urls_lock:
-        if url in visited_urls:
-            return
-        visited_urls.add(url)
-
+    # one request rebuilds, the others keep answering from the index it replaces;
+    # only the very first build is waited for, there is nothing to answer from before it
+    if not keyword_fallback_lock.acquire(blocking=serving_mode is None):
+        return
     try:
-        resp = requests.get(url, timeout=10)
-        if resp.status_code != 200:
-            return
-        if 'text/html' not in resp.headers.get('Content-Type', '').lower():
+        if index.is_servable() or keyword_fallback_is_fresh():
             return
+        keyword_index = BM25Index()
+        for doc in build_documents():
+            keyword_index.add(doc.metadata['source'], doc)
+        with serving_lock:
+            # the vector index may have been promoted during the rebuild
+            if index.is_servable():
+                return
+            serve_retriever(KeywordRetriever(index=keyword_index, k=Config.RETRIEVAL_TOP_K), 'keyword')
+            keyword_fallback_built_at = time.monotonic()
+    finally:
+        keyword_fallback_lock.release()
 
-        with html_urls_lock:
-            html_urls.append(url)
-
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        all_links = [urljoin(root_url, a.get('href')) for a in soup.find_all('a')]
-        all_links = filter(lambda x: x and x.startswith(root_url), all_links)
 
-        for link in all_links:
-            next_queue.put(link)
+def keyword_fallback_is_fresh():
+    return serving_mode == 'keyword' and time.monotonic() - keyword_fallback_built_at < Config.KEYWORD_FALLBACK_REFRESH
 
-    except requests.RequestException:
-        pass
 
-
-def bfs_website(root_url, max_workers=20):
-    visited_urls = set()
-    html_urls = []
-    global visited_urls_lock, html_urls_lock
-    visited_urls_lock = threading.Lock()
-    html_urls_lock = threading.Lock()
-
-    queue = Queue()
-    queue.put(root_url)
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        while not queue.empty():
-            next_queue = Queue()
-            futures = []
-            for _ in range(queue.qsize()):
-                url = queue.get()
-                future = executor.submit(process_url, url, root_url, visited_urls, html_urls, next_queue)
-                futures.append(future)
-            for future in as_completed(futures):
-                pass
-            queue = next_queue
-    return html_urls
-
-
-def scrapying_website():
+manager = None
+serving_mode = None
+serving_lock = threading.RLock()
+keyword_fallback_lock = threading.Lock()
+keyword_fallback_built_at = 0
+if index.is_servable():
+    serve_active_index()
+    scrapying_status['status'] = 'finished'
+if crawl_checkpoint.exists():
+    scrapying_status['status'] = 'interrupted'
+
+
+@retrieval_blueprint.record_once
+def start_background_jobs(state):
+    database_sync.start(state.app)
+    if Config.CRAWL_REFRESH_INTERVAL > 0:
+        threading.Thread(target=scheduled_refresh, args=(state.app,), daemon=True).start()
+
+
+def bfs_website(
+        root_url, on_page=None, conditional=False, on_unchanged=None, resume=None, on_checkpoint=None, progress=None
+):
+    return crawl_website(
+        root_url,
+        concurrency=Config.CRAWLER_CONCURRENCY,
+        per_host_limit=Config.CRAWLER_PER_HOST_LIMIT,
+        timeout=Config.CRAWLER_TIMEOUT,
+        max_depth=Config.CRAWLER_MAX_DEPTH,
+        max_pages=Config.CRAWLER_MAX_PAGES,
+        max_bytes=Config.CRAWLER_MAX_BYTES,
+        user_agent=Config.CRAWLER_USER_AGENT,
+        skip_index_paths=Config.CRAWLER_SKIP_INDEX_PATHS,
+        page_cache=page_cache,
+        conditional=conditional,
+        on_unchanged=on_unchanged,
+        resume=resume,
+        on_checkpoint=on_checkpoint,
+        checkpoint_interval=Config.CRAWL_CHECKPOINT_INTERVAL,
+        progress=progress,
+        on_page=on_page
+    )
+
+
+def index_database(app, shadow, progress):
+    with app.app_context():
+        splits = [split for doc in build_documents(attachments) for split in text_splitter.split_documents([doc])]
+    progress.add('chunks', len(splits))
+    add = progress.timed('index', shadow.add)
+    for i in range(0, len(splits), Config.EMBEDDING_BATCH_SIZE):
+        add(splits[i:i + Config.EMBEDDING_BATCH_SIZE])
+        progress.add('indexed', len(splits[i:i + Config.EMBEDDING_BATCH_SIZE]))
+
+
+def open_shadow(resume):
+    # a new crawl throws away the build of an interrupted one, a resumed crawl
+    # reopens it when the checkpoint still fits the live index
+    checkpoint = crawl_checkpoint.load()
+    if checkpoint is not None:
+        shadow = index.resume_shadow(checkpoint['shadow'], checkpoint['base']) if resume else None
+        if shadow is not None:
+            shadow.resume(checkpoint.get('indexed', []))
+            return shadow, checkpoint
+        if checkpoint['shadow'] not in (index.active.collection_name, index.previous):
+            index.drop(checkpoint['shadow'])
+        crawl_checkpoint.clear()
+
+    shadow = index.create_shadow()
+    shadow.begin()
+    return shadow, None
+
+
+def resume_state(checkpoint):
+    # pages whose chunks had not all reached the shadow when the checkpoint was
+    # taken were dropped from it by resume(), so they are fetched again
+    sources = set(checkpoint.get('indexed', []))
+    state = {'frontier': checkpoint['frontier'], 'outstanding': list(checkpoint['outstanding']), 'emitted': {}}
+    for url, (depth, source) in checkpoint['emitted'].items():
+        if source in sources:
+            state['emitted'][url] = [depth, source]
+        else:
+            state['outstanding'].append([url, depth])
+    return state
+
+
+def scrapying_website(app, incremental=False, resume=False):
+    global crawl_progress
+    crawl_progress = progress = CrawlProgress()
     scrapying_status['status'] = 'pending'
     scrapying_status['start_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    embedding.reset_stats()
+    attachments.reset_stats()
 
+    shadow = None
     try:
+        shadow, checkpoint = open_shadow(resume)
+        if checkpoint is not None:
+            incremental = checkpoint['incremental']
+        scrapying_status['mode'] = 'incremental' if incremental else 'full'
+        scrapying_status['resumed'] = checkpoint is not None
+
         root_url = Config.HOME_PAGE_URL
-        urls = bfs_website(root_url)
-        loader = AsyncHtmlLoader(urls)
-        docs = loader.load()
         md = MarkdownifyTransformer()
-        converted_docs = md.transform_documents(docs)
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=128)
-        splits = text_splitter.split_documents(converted_docs)
-        vectorstore = Chroma.from_documents(documents=splits, embedding=embedding)
-        retriever = vectorstore.as_retriever()
-        global manager
-        manager = UserMemoryManager(retriever, llm, inactive_time=300)
+        deduplicator = MinHashDeduplicator(threshold=Config.DEDUP_THRESHOLD)
+        # unchanged pages can only be skipped when their chunks can be copied from the live index
+        conditional = incremental and shadow.base is not None
+        unchanged_sources = []
+        crawl_state = None
+        indexed_sources = SourceTracker()
+        if checkpoint is not None:
+            unchanged_sources = checkpoint['unchanged']
+            page_cache.restore(checkpoint['page_cache'])
+            for doc in list(shadow.keyword_index.documents.values()):
+                deduplicator.remember(doc.page_content)
+            for source in unchanged_sources:
+                for doc in shadow.base_chunks(source):
+                    deduplicator.remember(doc.page_content)
+            crawl_state = resume_state(checkpoint)
+            indexed_sources = SourceTracker(checkpoint.get('indexed', []))
+
+        def save_checkpoint(state):
+            # taken before the shadow is persisted, a source only completes after its chunks were added
+            indexed = indexed_sources.completed()
+            shadow.checkpoint()
+            crawl_checkpoint.save(dict(
+                state,
+                indexed=indexed,
+                shadow=shadow.collection_name,
+                base=shadow.base.collection_name if shadow.base is not None else None,
+                incremental=incremental,
+                unchanged=list(unchanged_sources),
+                page_cache=page_cache.pending_rows()
+            ))
+
+        def keep_unchanged(source):
+            # the chunks of an unchanged page are carried over as they are, changed
+            # pages must not bring back the boilerplate the last crawl dropped from them
+            unchanged_sources.append(source)
+            for doc in shadow.base_chunks(source):
+                deduplicator.remember(doc.page_content)
+
+        def crawl(emit):
+            progress.start_crawl()
+            try:
+                bfs_website(
+                    root_url, on_page=emit, conditional=conditional, on_unchanged=keep_unchanged,
+                    resume=crawl_state, on_checkpoint=save_checkpoint, progress=progress
+                )
+            finally:
+                progress.finish_crawl()
+
+        def split(doc):
+            splits = text_splitter.split_documents([doc])
+            progress.add('chunks', len(splits))
+            indexed_sources.expect(doc.metadata['source'], len(splits))
+            return splits
+
+        def dedup(doc):
+            kept = deduplicator(doc)
+            if not kept:
+                progress.add('duplicates')
+                indexed_sources.done(doc.metadata['source'])
+            return kept
+
+        def add(batch):
+            shadow.add(batch)
+            progress.add('indexed', len(batch))
+            for doc in batch:
+                indexed_sources.done(doc.metadata['source'])
+
+        if root_url:
+            run_pipeline(
+                crawl,
+                [
+                    progress.timed('markdownify', lambda doc: md.transform_documents([doc])),
+                    progress.timed('split', split),
+                    progress.timed('dedup', dedup),
+                    Batcher(Config.EMBEDDING_BATCH_SIZE, max_delay=Config.CRAWL_CHECKPOINT_INTERVAL),
+                    progress.timed('index', add),
+                ],
+                maxsize=Config.PIPELINE_QUEUE_SIZE
+            )
+            for source in unchanged_sources:
+                shadow.keep_source(source)
+            scrapying_status['dedup'] = deduplicator.stats()
+            scrapying_status['unchanged_pages'] = len(unchanged_sources)
+        index_database(app, shadow, progress)
+        sync_result = shadow.finish()
+        print(f"索引同步完成: {sync_result}")
+        index.promote(shadow)
+        crawl_checkpoint.clear()
+        page_cache.commit()
+        serve_active_index()
+        database_sync.request_reconcile()
     except Exception as e:
         print(e)
+        page_cache.discard()
+        # with a checkpoint the build is kept so that it can be resumed
+        if shadow is not None and not crawl_checkpoint.exists():
+            index.discard(shadow)
         scrapying_status['status'] = 'error'
         return
 
     scrapying_status['status'] = 'finished'
     scrapying_status['end_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    scrapying_status['embedding_cache'] = embedding.stats()
+    scrapying_status['attachment_cache'] = attachments.stats()
 
 
 def chat_with_rag(user_id, question):
     global manager
-    chain = manager.get_chain_for_user(user_id)
-    result = chain({"question": question})
+    result = llm_pool.run(manager.chat, user_id, question)
 
     answer = result['answer']
     source_list = [source.metadata['source'] for source in result['source_documents']]
@@ -176,6 +568,50 @@ def chat_with_rag(user_id, question):
     return answer, source_list
 
 
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_chat_with_rag(user_id, question, mode):
+    # submitted before the response starts, so a saturated pool still answers with a 503;
+    # a failed attempt is only retried while no token has reached the client
+    handler = TokenQueueHandler()
+    future = llm_pool.submit(
+        manager.chat, user_id, question, callbacks=[handler], can_retry=lambda: not handler.streamed
+    )
+    future.add_done_callback(lambda _: handler.queue.put(None))
+    return relay_chat_stream(handler, future, mode)
+
+
+def relay_chat_stream(handler, future, mode):
+    while True:
+        try:
+            token = handler.queue.get(timeout=llm_pool.timeout)
+        except Empty:
+            future.cancel()
+            yield server_sent_event('error', {'description': 'chat retrieval augmented generation timed out'})
+            return
+        if token is None:
+            break
+        yield server_sent_event('token', {'token': token})
+
+    try:
+        result = future.result()
+    except Exception as e:
+        print(e)
+        yield server_sent_event('error', {'description': 'chat retrieval augmented generation failed'})
+        return
+
+    if result.get('cached'):
+        yield server_sent_event('token', {'token': result['answer']})
+
+    yield server_sent_event('sources', {
+        'answer': result['answer'],
+        'source_list': [source.metadata['source'] for source in result['source_documents']],
+        'mode': mode
+    })
+
+
 def periodic_cleanup():
     global manager
     while True:
@@ -183,12 +619,52 @@ def periodic_cleanup():
         if manager:
             cleaned = manager.clean_inactive_memories()
             print(f"已清理 {cleaned} 個不活躍使用者的記憶")
+        if session_backend:
+            try:
+                session_backend.purge(Config.RETRIEVAL_INACTIVE_TIME)
+            except Exception as e:
+                print(e)
+        if index.refresh() and index.is_servable():
+            serve_active_index()
+        elif index.active.refresh_keywords():
+            answer_cache.clear()
 
 
 cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
 cleanup_thread.start()
 
 
+def acquire_crawl_lock():
+    # workers share the index directory, the file lock lets only one of them crawl;
+    # the lock is held until the returned file is closed
+    lock_path = Path(Config.RETRIEVAL_PERSIST_DIRECTORY) / 'crawl.lock'
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(lock_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def locked_scrapying_website(lock_file, app, incremental=False, resume=False):
+    with lock_file:
+        scrapying_website(app, incremental, resume)
+
+
+def scheduled_refresh(app):
+    # every worker runs this loop, the crawl lock lets only one of them crawl
+    while True:
+        time.sleep(Config.CRAWL_REFRESH_INTERVAL)
+        if scrapying_status['status'] == 'pending':
+            continue
+        lock_file = acquire_crawl_lock()
+        if lock_file is None:
+            continue
+        locked_scrapying_website(lock_file, app, incremental=True)
+
+
 @retrieval_blueprint.route('/start-scrapying', methods=['GET'])
 def start_scrapying():
     """
@@ -196,6 +672,17 @@ def start_scrapying():
     ---
     tags:
       - retrieval
+    parameters:
+      - in: query
+        name: incremental
+        type: boolean
+        required: false
+        description: only re-process pages that changed since the last crawl
+      - in: query
+        name: resume
+        type: boolean
+        required: false
+        description: continue an interrupted crawl from its last checkpoint
     responses:
       200:
         description: start scrapying
@@ -208,10 +695,32 @@ def start_scrapying():
               properties:
                 status:
                   type: string
+                mode:
+                  type: string
+                unchanged_pages:
+                  type: integer
                 start_time:
                   type: string
                 end_time:
                   type: string
+                embedding_cache:
+                  properties:
+                    hits:
+                      type: integer
+                    misses:
+                      type: integer
+                attachment_cache:
+                  properties:
+                    hits:
+                      type: integer
+                    misses:
+                      type: integer
+                dedup:
+                  properties:
+                    chunks:
+                      type: integer
+                    duplicates:
+                      type: integer
       400:
         description: scrapying is pending
     """
@@ -219,12 +728,54 @@ def start_scrapying():
     if scrapying_status['status'] == 'pending':
         return Response.client_error('scrapying is pending', scrapying_status)
 
-    scrapying_website_thread = threading.Thread(target=scrapying_website)
+    # another worker may be crawling into the same index directory
+    lock_file = acquire_crawl_lock()
+    if lock_file is None:
+        return Response.client_error('scrapying is pending', scrapying_status)
+
+    incremental = request.args.get('incremental', '').lower() in ('1', 'true')
+    resume = request.args.get('resume', '').lower() in ('1', 'true')
+    scrapying_website_thread = threading.Thread(
+        target=locked_scrapying_website, args=(lock_file, current_app._get_current_object(), incremental, resume)
+    )
     scrapying_website_thread.start()
 
     return Response.response('start scrapying successful', scrapying_status)
 
 
+@retrieval_blueprint.route('/rollback-index', methods=['GET'])
+def rollback_index():
+    """
+    roll back to the index that was serving before the last rebuild
+    ---
+    tags:
+      - retrieval
+    responses:
+      200:
+        description: rollback index successful
+        schema:
+          id: scrapying_status
+      400:
+        description: scrapying is pending or there is no previous index
+    """
+    if scrapying_status['status'] == 'pending':
+        return Response.client_error('scrapying is pending', scrapying_status)
+
+    if not index.rollback():
+        return Response.client_error('no previous index to roll back to', scrapying_status)
+
+    # the validators describe the newer index, so the next crawl has to fetch everything again
+    page_cache.clear()
+    if index.is_servable():
+        serve_active_index()
+    else:
+        try:
+            serve_keyword_fallback()
+        except Exception as e:
+            print(e)
+    return Response.response('rollback index successful', scrapying_status)
+
+
 @retrieval_blueprint.route('/scrapying-status', methods=['GET'])
 def check_scrapying_status():
     """
@@ -244,12 +795,125 @@ def check_scrapying_status():
               properties:
                 status:
                   type: string
+                mode:
+                  type: string
+                unchanged_pages:
+                  type: integer
                 start_time:
                   type: string
                 end_time:
                   type: string
+                embedding_cache:
+                  properties:
+                    hits:
+                      type: integer
+                    misses:
+                      type: integer
+                attachment_cache:
+                  properties:
+                    hits:
+                      type: integer
+                    misses:
+                      type: integer
+                dedup:
+                  properties:
+                    chunks:
+                      type: integer
+                    duplicates:
+                      type: integer
+                progress:
+                  properties:
+                    queued:
+                      type: integer
+                    fetched:
+                      type: integer
+                    failed:
+                      type: integer
+                    skipped:
+                      type: integer
+                    unchanged:
+                      type: integer
+                    bytes:
+                      type: integer
+                    chunks:
+                      type: integer
+                    duplicates:
+                      type: integer
+                    indexed:
+                      type: integer
+                    elapsed_seconds:
+                      type: number
+                    pages_per_second:
+                      type: number
+                    bytes_per_second:
+                      type: number
+                    stage_seconds:
+                      description: elapsed seconds of crawl, markdownify, split, dedup, embed and index
+                      type: object
+                    embeddings:
+                      properties:
+                        cached:
+                          type: integer
+                        computed:
+                          type: integer
+    """
+    return Response.response(
+        'check status successful', dict(scrapying_status, progress=crawl_progress.snapshot(embedding.stats()))
+    )
+
+
+@retrieval_blueprint.route('/query-metrics', methods=['GET'])
+def query_metrics():
+    """
+    metrics of the question-condensing step of /retrieval/query
+    ---
+    tags:
+      - retrieval
+    responses:
+      200:
+        description: query metrics
+        schema:
+          id: query_metrics
+          properties:
+            description:
+              type: string
+            response:
+              properties:
+                condensed:
+                  type: integer
+                skipped:
+                  type: integer
+                total_seconds:
+                  type: number
+                average_seconds:
+                  type: number
+                total_tokens:
+                  type: integer
+                total_cost:
+                  type: number
+                llm_pool:
+                  properties:
+                    accepted:
+                      type: integer
+                    rejected:
+                      type: integer
+                    timed_out:
+                      type: integer
+                    retried:
+                      type: integer
+                    failed:
+                      type: integer
+                    in_flight:
+                      type: integer
+      400:
+        description: scrapying is not ready
     """
-    return Response.response('check status successful', scrapying_status)
+    if manager is None:
+        return Response.client_error('scrapying is not ready', scrapying_status)
+
+    return Response.response(
+        'check query metrics successful', dict(manager.get_condense_metrics(), llm_pool=llm_pool.stats())
+    )
 
 
 @retrieval_blueprint.route('/query', methods=['GET'])
@@ -270,21 +934,75 @@ def query():
         description: person who can multi-turn conversations
         required: true
         type: string
+      - name: stream
+        in: query
+        description: stream the answer as server-sent events, tokens first and the source list last
+        required: false
+        type: string
     responses:
       200:
         description: chat retrieval augmented generation
+        schema:
+          id: retrieval_answer
+          properties:
+            description:
+              type: string
+            response:
+              properties:
+                answer:
+                  type: string
+                source_list:
+                  type: array
+                  items:
+                    type: string
+                mode:
+                  type: string
+                  description: vector when the crawled index answered, keyword when the database fallback did
       400:
         description: scrapying is not ready
+      503:
+        description: too many queries are waiting for the llm
+      504:
+        description: the llm did not answer in time
     """
-    if scrapying_status['status'] == 'pending' or scrapying_status['status'] == 'not start':
+    refreshed = index.refresh()
+    if index.active.refresh_keywords():
+        # another worker synced a database edit, cached answers may quote the old row
+        answer_cache.clear()
+    if index.is_servable():
+        if refreshed or serving_mode != 'vector':
+            serve_active_index()
+    else:
+        try:
+            serve_keyword_fallback()
+        except Exception as e:
+            print(e)
+
+    if manager is None:
         return Response.client_error('scrapying is not ready', scrapying_status)
 
     if 'query_string' not in request.args or 'person_id' not in request.args:
         return Response.client_error('query_string, person_id is required')
 
-    answer, source_list = chat_with_rag(request.args['person_id'], request.args['query_string'])
+    mode = serving_mode
+    try:
+        if request.args.get('stream') in ('1', 'true'):
+            return FlaskResponse(
+                stream_with_context(
+                    stream_chat_with_rag(request.args['person_id'], request.args['query_string'], mode)
+                ),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        answer, source_list = chat_with_rag(request.args['person_id'], request.args['query_string'])
+    except PoolSaturated:
+        return Response.service_unavailable('chatbot is busy, please try again later')
+    except PoolTimeout:
+        return Response.gateway_timeout('chat retrieval augmented generation timed out')
 
     return Response.response('chat retrieval augmented generation successful', {
         'answer': answer,
-        'source_list': source_list
+        'source_list': source_list,
+        'mode': mode
     })
@@ -19,6 +19,67 @@ class Config:
     DASH_BOARD_URL = os.getenv("DASH_BOARD_URL")
     HOME_PAGE_URL = os.getenv("HOME_PAGE_URL")
 
+    CRAWLER_CONCURRENCY = int(os.getenv("CRAWLER_CONCURRENCY", 20))
+    CRAWLER_PER_HOST_LIMIT = int(os.getenv("CRAWLER_PER_HOST_LIMIT", 8))
+    CRAWLER_TIMEOUT = int(os.getenv("CRAWLER_TIMEOUT", 10))
+    CRAWLER_MAX_DEPTH = int(os.getenv("CRAWLER_MAX_DEPTH", 5))
+    CRAWLER_MAX_PAGES = int(os.getenv("CRAWLER_MAX_PAGES", 2000))
+    CRAWLER_MAX_BYTES = int(os.getenv("CRAWLER_MAX_BYTES", 5 * 1024 * 1024))
+    CRAWLER_USER_AGENT = os.getenv("CRAWLER_USER_AGENT", "widm-back-end")
+    CRAWLER_PAGE_CACHE_PATH = os.getenv("CRAWLER_PAGE_CACHE_PATH", "instance/page_cache.sqlite3")
+    # comma separated path prefixes of the home page that render the member, news, paper and
+    # project tables; those rows are indexed from the database, so these pages are only followed for links
+    CRAWLER_SKIP_INDEX_PATHS = [
+        path.strip() for path in os.getenv("CRAWLER_SKIP_INDEX_PATHS", "").split(",") if path.strip()
+    ]
+    # seconds between scheduled incremental re-crawls, 0 turns the scheduler off
+    CRAWL_REFRESH_INTERVAL = int(os.getenv("CRAWL_REFRESH_INTERVAL", 0))
+    CRAWL_CHECKPOINT_PATH = os.getenv("CRAWL_CHECKPOINT_PATH", "instance/crawl_checkpoint.json.gz")
+    CRAWL_CHECKPOINT_INTERVAL = int(os.getenv("CRAWL_CHECKPOINT_INTERVAL", 30))
+
+    RETRIEVAL_PERSIST_DIRECTORY = os.getenv("RETRIEVAL_PERSIST_DIRECTORY", "instance/retrieval")
+    # chroma (hnsw) or flat (memory-mapped numpy matrix, float16 or int8)
+    VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+    VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 4))
+    RETRIEVAL_KEYWORD_WEIGHT = float(os.getenv("RETRIEVAL_KEYWORD_WEIGHT", 0.5))
+    DATABASE_SYNC_INTERVAL = int(os.getenv("DATABASE_SYNC_INTERVAL", 300))
+    KEYWORD_FALLBACK_REFRESH = int(os.getenv("KEYWORD_FALLBACK_REFRESH", 300))
+    RETRIEVAL_MAX_USERS = int(os.getenv("RETRIEVAL_MAX_USERS", 1000))
+    RETRIEVAL_INACTIVE_TIME = int(os.getenv("RETRIEVAL_INACTIVE_TIME", 300))
+    RETRIEVAL_MAX_MEMORY_TOKENS = int(os.getenv("RETRIEVAL_MAX_MEMORY_TOKENS", 2000000))
+    # window keeps the last turns verbatim, summary folds turns beyond the token budget into a running summary
+    RETRIEVAL_MEMORY_MODE = os.getenv("RETRIEVAL_MEMORY_MODE", "window")
+    RETRIEVAL_MEMORY_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_MEMORY_TOKEN_BUDGET", 1000))
+    # memory (per process), database (SQLALCHEMY_DATABASE_URI) or sqlite (RETRIEVAL_SESSION_SQLITE_PATH)
+    RETRIEVAL_SESSION_BACKEND = os.getenv("RETRIEVAL_SESSION_BACKEND", "memory")
+    RETRIEVAL_SESSION_SQLITE_PATH = os.getenv("RETRIEVAL_SESSION_SQLITE_PATH", "instance/sessions.sqlite3")
+    RETRIEVAL_SESSION_FLUSH_INTERVAL = float(os.getenv("RETRIEVAL_SESSION_FLUSH_INTERVAL", 1.0))
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 512))
+    # llm calls of /retrieval/query run on a bounded pool, requests beyond workers + queue get a 503
+    LLM_WORKERS = int(os.getenv("LLM_WORKERS", 4))
+    LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 16))
+    # seconds for one openai request, and for a whole query including queueing and retries
+    LLM_TIMEOUT = int(os.getenv("LLM_TIMEOUT", 30))
+    LLM_REQUEST_TIMEOUT = int(os.getenv("LLM_REQUEST_TIMEOUT", 90))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+    # openai, onnx (local model exported to onnx) or hashing (no model files, works offline)
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+    EMBEDDING_ONNX_MODEL_PATH = os.getenv("EMBEDDING_ONNX_MODEL_PATH", "instance/embedding/model.onnx")
+    EMBEDDING_ONNX_TOKENIZER_PATH = os.getenv("EMBEDDING_ONNX_TOKENIZER_PATH", "instance/embedding/tokenizer.json")
+    EMBEDDING_LOCAL_BATCH_SIZE = int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE", 32))
+    EMBEDDING_HASHING_FEATURES = int(os.getenv("EMBEDDING_HASHING_FEATURES", 1024))
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "instance/embedding_cache.sqlite3")
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))
+    ATTACHMENT_CACHE_PATH = os.getenv("ATTACHMENT_CACHE_PATH", "instance/attachment_cache.sqlite3")
+    ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", 4))
+    # crawled chunks at least this similar (estimated jaccard) to an earlier chunk are not indexed
+    DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.9))
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 32))
+
     WHITE_LIST = [
         "110502528", "110502528", "112522087", "F443693", "112522049", "112522102", "112522051", "112522092",
         "113522140", "113522139", "113922002", "113522079", "113522152"
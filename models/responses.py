@@ -26,6 +26,14 @@ class Response:
     def unauthorized(msg, rsp=None):
         return {'description': msg, 'response': rsp}, 401
 
+    @staticmethod
+    def service_unavailable(msg, rsp=None):
+        return {'description': msg, 'response': rsp}, 503
+
+    @staticmethod
+    def gateway_timeout(msg, rsp=None):
+        return {'description': msg, 'response': rsp}, 504
+
     @staticmethod
     def jodit_get_all(files):
         return {
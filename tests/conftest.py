@@ -0,0 +1,69 @@
+import sys
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def page(*links):
+    body = ''.join(f'<a href="{link}">{link}</a>' for link in links)
+    return f'<html><head><title>page</title></head><body>{body}</body></html>'
+
+
+SITE = {
+    '/robots.txt': 'User-agent: *\nDisallow: /private/\n',
+    '/': page('a.html', 'b.html', 'private/x.html', 'a.html#people', '/a.html?utm_source=mail', 'http://other.test/'),
+    '/a.html': page('c.html'),
+    '/b.html': page('/'),
+    '/c.html': page('d.html'),
+    '/d.html': page(),
+    '/private/x.html': page(),
+}
+
+
+class FixtureSite:
+    def __init__(self, url):
+        self.url = url
+        self.requests = []
+
+    def hits(self, path):
+        return [request for request in self.requests if request[0] == path]
+
+
+@pytest.fixture
+def site():
+    # an aiohttp server on its own loop and thread, the crawler runs its own event loop
+    loop = asyncio.new_event_loop()
+    fixture = None
+
+    async def handler(request):
+        fixture.requests.append((request.path, request.headers.get('If-None-Match')))
+        if request.path not in SITE:
+            return web.Response(status=404)
+        etag = f'"{request.path}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        if request.path.endswith('.txt'):
+            return web.Response(text=SITE[request.path])
+        return web.Response(text=SITE[request.path], content_type='text/html', headers={'ETag': etag})
+
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', handler)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    server = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(server.start())
+    port = server._server.sockets[0].getsockname()[1]
+    fixture = FixtureSite(f'http://127.0.0.1:{port}')
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield fixture
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
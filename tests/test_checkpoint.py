@@ -0,0 +1,24 @@
+from utiles.checkpoint import CrawlCheckpoint, SourceTracker
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = CrawlCheckpoint(tmp_path / 'crawl.json.gz')
+    assert checkpoint.load() is None
+
+    checkpoint.save({'shadow': 'widm-1', 'emitted': {'http://lab.test/': [0, 'http://lab.test/']}})
+    assert checkpoint.load()['shadow'] == 'widm-1'
+
+    checkpoint.clear()
+    assert not checkpoint.exists()
+
+
+def test_source_completes_once_every_chunk_is_stored_or_dropped():
+    tracker = SourceTracker(['http://lab.test/'])
+    tracker.expect('http://lab.test/a', 3)
+    tracker.expect('http://lab.test/empty', 0)
+
+    tracker.done('http://lab.test/a', 2)
+    assert set(tracker.completed()) == {'http://lab.test/', 'http://lab.test/empty'}
+
+    tracker.done('http://lab.test/a')
+    assert 'http://lab.test/a' in tracker.completed()
@@ -0,0 +1,68 @@
+from utiles.crawler import crawl_website
+from utiles.frontier import canonicalize_url
+from utiles.page_cache import PageCache
+
+
+def sources(pages):
+    return {doc.metadata['source'] for doc in pages}
+
+
+def test_crawl_follows_links_within_scope(site):
+    pages = crawl_website(site.url + '/', concurrency=4)
+
+    assert sources(pages) == {site.url + path for path in ('/', '/a.html', '/b.html', '/c.html', '/d.html')}
+    # the fragment and tracking variants of a.html are the same page
+    assert len(site.hits('/a.html')) == 1
+
+
+def test_crawl_obeys_robots_txt(site):
+    crawl_website(site.url + '/', concurrency=4)
+
+    assert site.hits('/private/x.html') == []
+
+
+def test_crawl_stops_at_max_depth(site):
+    pages = crawl_website(site.url + '/', concurrency=4, max_depth=1)
+
+    assert sources(pages) == {site.url + path for path in ('/', '/a.html', '/b.html')}
+
+
+def test_crawl_stops_at_max_pages(site):
+    pages = crawl_website(site.url + '/', concurrency=4, max_pages=2)
+
+    assert len(pages) == 2
+
+
+def test_conditional_crawl_keeps_unchanged_pages(site, tmp_path):
+    page_cache = PageCache(tmp_path / 'page_cache.sqlite3')
+    crawl_website(site.url + '/', concurrency=4, page_cache=page_cache)
+    page_cache.commit()
+    site.requests.clear()
+
+    unchanged = []
+    pages = crawl_website(
+        site.url + '/', concurrency=4, page_cache=page_cache, conditional=True, on_unchanged=unchanged.append
+    )
+
+    assert pages == []
+    assert site.hits('/a.html') == [('/a.html', '"/a.html"')]
+    # links stored with an unchanged page keep the crawl going
+    assert set(unchanged) == {site.url + path for path in ('/', '/a.html', '/b.html', '/c.html', '/d.html')}
+
+
+def test_crawl_resumes_from_its_state(site):
+    root, a = site.url + '/', site.url + '/a.html'
+    state = {
+        'frontier': {
+            'seen': [canonicalize_url(root), canonicalize_url(a), canonicalize_url(site.url + '/b.html')],
+            'skipped': {'robots': 0, 'depth': 0, 'budget': 0},
+            'robots': 'User-agent: *\nDisallow: /private/\n',
+        },
+        'outstanding': [[a, 1]],
+        'emitted': {root: [0, root], site.url + '/b.html': [1, site.url + '/b.html']},
+    }
+
+    pages = crawl_website(root, concurrency=4, resume=state)
+
+    assert sources(pages) == {site.url + path for path in ('/a.html', '/c.html', '/d.html')}
+    assert site.hits('/') == [] and site.hits('/robots.txt') == []
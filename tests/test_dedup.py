@@ -0,0 +1,21 @@
+from langchain_core.documents import Document
+
+from utiles.dedup import MinHashDeduplicator
+
+FOOTER = 'Web Intelligence and Data Mining Laboratory, National Central University, Taoyuan, Taiwan. All rights reserved.'
+
+
+def test_near_duplicate_chunks_are_dropped():
+    deduplicator = MinHashDeduplicator(threshold=0.8)
+
+    assert deduplicator(Document(page_content=FOOTER)) != []
+    assert deduplicator(Document(page_content=FOOTER.replace('Taiwan.', 'Taiwan'))) == []
+    assert deduplicator(Document(page_content='Alice joined the lab in 2021 and works on retrieval.')) != []
+    assert deduplicator.stats() == {'chunks': 3, 'duplicates': 1}
+
+
+def test_remembered_chunks_count_as_kept():
+    deduplicator = MinHashDeduplicator(threshold=0.8)
+    deduplicator.remember(FOOTER)
+
+    assert deduplicator.is_duplicate(FOOTER)
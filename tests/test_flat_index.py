@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from utiles.flat_index import FlatVectorStore
+
+
+class AxisEmbeddings:
+    # every text containing "alice" points along the first axis, anything else along the second
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [1.0, 0.0, 0.0] if 'alice' in text else [0.0, 1.0, 0.0]
+
+
+def add(store, doc_id, text):
+    store.add_documents([Document(page_content=text, metadata={'source': doc_id})], ids=[doc_id])
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_search_returns_the_closest_documents(tmp_path, dtype):
+    store = FlatVectorStore(tmp_path, AxisEmbeddings(), dtype=dtype)
+    add(store, 'member/1', 'alice wang')
+    add(store, 'member/2', 'bob chen')
+    store.persist()
+
+    assert [doc.page_content for doc in store.similarity_search('alice', k=1)] == ['alice wang']
+    assert np.allclose(store.records(['member/1'])['embeddings'][0], [1.0, 0.0, 0.0], atol=1e-2)
+
+
+def test_workers_write_on_top_of_each_other(tmp_path):
+    first = FlatVectorStore(tmp_path, AxisEmbeddings(), embedding_name='axis')
+    second = FlatVectorStore(tmp_path, AxisEmbeddings(), embedding_name='axis')
+
+    with first.transaction():
+        add(first, 'member/1', 'alice wang')
+    with second.transaction():
+        add(second, 'member/2', 'bob chen')
+
+    reopened = FlatVectorStore(tmp_path, AxisEmbeddings())
+    assert sorted(reopened.stored_ids()) == ['member/1', 'member/2']
+    assert reopened.embedding_name() == 'axis'
+
+
+def test_failed_transaction_is_discarded(tmp_path):
+    store = FlatVectorStore(tmp_path, AxisEmbeddings())
+    with store.transaction():
+        add(store, 'member/1', 'alice wang')
+
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.delete(['member/1'])
+            raise RuntimeError
+
+    assert store.stored_ids() == ['member/1']
+    with store.transaction():
+        store.delete(['member/1'])
+    assert FlatVectorStore(tmp_path, AxisEmbeddings()).count() == 0
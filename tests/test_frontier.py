@@ -0,0 +1,51 @@
+from utiles.frontier import UrlFrontier, canonicalize_url
+
+
+def test_canonicalize_url_drops_fragment_tracking_port_and_trailing_slash():
+    assert canonicalize_url('HTTP://Lab.Test:80/members/#top') == 'http://lab.test/members'
+    assert canonicalize_url('https://lab.test/a/../news?utm_source=x&b=2&a=1') == 'https://lab.test/news?a=1&b=2'
+    assert canonicalize_url('https://lab.test') == 'https://lab.test/'
+
+
+def test_canonicalize_url_keeps_ref():
+    assert canonicalize_url('https://lab.test/paper?ref=3') == 'https://lab.test/paper?ref=3'
+
+
+def test_frontier_accepts_each_page_once_and_only_in_scope():
+    frontier = UrlFrontier('http://lab.test/lab/')
+
+    assert frontier.add('http://lab.test/lab/', 0)
+    assert not frontier.add('http://lab.test/lab', 0)
+    assert frontier.add('http://lab.test/lab/members.html', 1)
+    assert not frontier.add('http://lab.test/members.html', 1)
+    assert not frontier.add('http://other.test/lab/', 1)
+
+
+def test_frontier_applies_robots_and_budgets():
+    frontier = UrlFrontier('http://lab.test/', max_depth=2, max_pages=2)
+    frontier.set_robots('User-agent: *\nDisallow: /private/\n')
+
+    assert not frontier.add('http://lab.test/private/a', 1)
+    assert not frontier.add('http://lab.test/deep', 3)
+    assert frontier.add('http://lab.test/', 0)
+    assert frontier.add('http://lab.test/a', 1)
+    assert not frontier.add('http://lab.test/b', 1)
+    assert frontier.skipped == {'robots': 1, 'depth': 1, 'budget': 1}
+
+
+def test_frontier_claims_a_canonical_url_once():
+    frontier = UrlFrontier('http://lab.test/')
+    frontier.add('http://lab.test/news', 0)
+
+    assert not frontier.claim('http://lab.test/news/')
+    assert frontier.claim('http://lab.test/news/1')
+    assert not frontier.claim('http://lab.test/news/1')
+
+
+def test_frontier_skips_indexing_configured_paths():
+    frontier = UrlFrontier('http://lab.test/', skip_index_paths=['/member/'])
+
+    assert not frontier.indexable('http://lab.test/member')
+    assert not frontier.indexable('http://lab.test/member/3')
+    assert frontier.indexable('http://lab.test/members')
+    assert frontier.indexable('http://lab.test/')
@@ -0,0 +1,81 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question):
+    return re.sub(r'\s+', ' ', question).strip().lower()
+
+
+class SemanticAnswerCache:
+    def __init__(self, embedding, threshold=0.95, ttl=3600, max_size=512):
+        self.embedding = embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        # vectors of questions that missed, so put() does not embed the same question again
+        self.miss_vectors = OrderedDict()
+        self.lock = threading.Lock()
+
+    def embed(self, question):
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def expire(self):
+        now = time.monotonic()
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry['expires_at'] > now:
+                break
+            del self.entries[key]
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self.lock:
+            self.expire()
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry['result']
+            if not self.entries:
+                return None
+
+        vector = self.embed(key)
+        with self.lock:
+            keys = list(self.entries)
+            scores = np.stack([self.entries[k]['vector'] for k in keys]) @ vector if keys else None
+            if scores is not None and scores.max() >= self.threshold:
+                return self.entries[keys[int(np.argmax(scores))]]['result']
+            self.remember_miss(key, vector)
+            return None
+
+    def remember_miss(self, key, vector):
+        self.miss_vectors.pop(key, None)
+        self.miss_vectors[key] = vector
+        while len(self.miss_vectors) > self.max_size:
+            self.miss_vectors.popitem(last=False)
+
+    def put(self, question, result):
+        key = normalize_question(question)
+        with self.lock:
+            vector = self.miss_vectors.pop(key, None)
+        if vector is None:
+            vector = self.embed(key)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                'vector': vector,
+                'result': result,
+                'expires_at': time.monotonic() + self.ttl
+            }
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.miss_vectors.clear()
@@ -0,0 +1,63 @@
+import os
+import gzip
+import json
+import threading
+from pathlib import Path
+
+
+class CrawlCheckpoint:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def exists(self):
+        return self.path.exists()
+
+    def load(self):
+        if not self.path.exists():
+            return None
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"讀取爬取進度失敗: {e}")
+            return None
+
+    def save(self, state):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+
+class SourceTracker:
+    # counts the chunks of every page that are still on their way through the
+    # pipeline; a page is complete once each of its chunks has been stored in the
+    # shadow or dropped as a duplicate, and only complete pages are skipped on resume
+    def __init__(self, complete=()):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.complete = set(complete)
+
+    def expect(self, source, count):
+        with self.lock:
+            if count:
+                self.pending[source] = self.pending.get(source, 0) + count
+            else:
+                self.complete.add(source)
+
+    def done(self, source, count=1):
+        with self.lock:
+            remaining = self.pending.get(source, 0) - count
+            if remaining > 0:
+                self.pending[source] = remaining
+            else:
+                self.pending.pop(source, None)
+                self.complete.add(source)
+
+    def completed(self):
+        with self.lock:
+            return list(self.complete)
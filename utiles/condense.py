@@ -0,0 +1,20 @@
+import re
+
+# words that only make sense with the earlier turns of the conversation
+REFERENCE_PATTERN = re.compile(
+    r"\b(he|she|it|they|him|her|them|his|hers|its|their|theirs|this|that|these|those|there|"
+    r"above|previous|earlier|former|latter|same|again|also|another|else|more|other)\b"
+    r"|^\s*(and|but|so|or|what about|how about)\b"
+    r"|他|她|它|這|那|此|該|其|上述|剛才|剛剛|之前|前面|以上|還有|另外|其他|呢\s*[?？]?\s*$",
+    re.IGNORECASE
+)
+
+
+def is_standalone_question(question, min_words=3):
+    if REFERENCE_PATTERN.search(question):
+        return False
+    words = question.split()
+    # a very short latin question such as "2023?" usually continues the previous turn
+    if len(words) < min_words and question.isascii():
+        return False
+    return True
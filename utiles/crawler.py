@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+from urllib.parse import urldefrag, urljoin
+from xml.etree import ElementTree
+
+import aiohttp
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+
+from utiles.frontier import UrlFrontier, canonicalize_url
+
+
+class AsyncCrawler:
+    def __init__(
+            self, root_url, concurrency=20, per_host_limit=8, timeout=10, on_page=None, max_depth=5, max_pages=2000,
+            max_bytes=5 * 1024 * 1024, user_agent='widm-back-end', max_sitemaps=20, page_cache=None,
+            conditional=False, on_unchanged=None, resume=None, on_checkpoint=None, checkpoint_interval=30,
+            progress=None, skip_index_paths=()
+    ):
+        self.root_url = root_url
+        self.on_page = on_page
+        self.page_cache = page_cache
+        self.conditional = conditional and page_cache is not None
+        self.on_unchanged = on_unchanged
+        self.resume = resume
+        self.on_checkpoint = on_checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.user_agent = user_agent
+        self.max_sitemaps = max_sitemaps
+        self.progress = progress
+        self.frontier = UrlFrontier(
+            root_url, max_depth=max_depth, max_pages=max_pages, user_agent=user_agent,
+            on_skip=lambda reason: self.count('skipped'), skip_index_paths=skip_index_paths
+        )
+        # urls queued or being fetched, and urls whose page went into the pipeline
+        self.outstanding = {}
+        self.emitted = {}
+        self.pages = []
+        self.queue = None
+        self.error = None
+
+    async def crawl(self):
+        self.queue = asyncio.Queue()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {'User-Agent': self.user_agent}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            if self.resume:
+                self.restore(self.resume)
+            else:
+                await self.seed(session)
+            workers = [asyncio.create_task(self.worker(session)) for _ in range(self.concurrency)]
+            if self.on_checkpoint is not None:
+                workers.append(asyncio.create_task(self.checkpoint_loop()))
+            await self.queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if self.error:
+            raise self.error
+        return self.pages
+
+    async def seed(self, session):
+        robots = await self.fetch_text(session, urljoin(self.root_url, '/robots.txt'))
+        if robots:
+            self.frontier.set_robots(robots)
+        self.enqueue(self.root_url, 0)
+        for url in await self.sitemap_urls(session):
+            self.enqueue(url, 0)
+
+    def count(self, name, amount=1):
+        if self.progress is not None:
+            self.progress.add(name, amount)
+
+    def state(self):
+        # taken inside the event loop, so the three parts are consistent with each other
+        return {
+            'frontier': self.frontier.state(),
+            'outstanding': list(self.outstanding.items()),
+            'emitted': dict(self.emitted),
+        }
+
+    def restore(self, state):
+        self.frontier.restore(state['frontier'])
+        self.emitted = dict(state['emitted'])
+        for url, depth in state['outstanding']:
+            self.outstanding[url] = depth
+            self.queue.put_nowait((url, depth))
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await asyncio.to_thread(self.on_checkpoint, self.state())
+            except Exception as e:
+                print(f"儲存爬取進度失敗: {e}")
+
+    async def sitemap_urls(self, session):
+        pending = self.frontier.sitemaps() or [urljoin(self.root_url, '/sitemap.xml')]
+        fetched, urls = set(), []
+        while pending and len(fetched) < self.max_sitemaps:
+            sitemap = pending.pop()
+            if sitemap in fetched:
+                continue
+            fetched.add(sitemap)
+            text = await self.fetch_text(session, sitemap)
+            if not text:
+                continue
+            try:
+                root = ElementTree.fromstring(text.strip())
+            except ElementTree.ParseError:
+                continue
+            locs = [element.text.strip() for element in root.iter() if element.tag.endswith('loc') and element.text]
+            if root.tag.endswith('sitemapindex'):
+                pending.extend(locs)
+            else:
+                urls.extend(locs)
+        return urls
+
+    async def fetch_text(self, session, url):
+        try:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                return await self.read_limited(resp)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async def read_limited(self, resp):
+        if resp.content_length and resp.content_length > self.max_bytes:
+            self.count('skipped')
+            return None
+        chunks, size = [], 0
+        async for chunk in resp.content.iter_chunked(1 << 16):
+            size += len(chunk)
+            self.count('bytes', len(chunk))
+            if size > self.max_bytes:
+                self.count('skipped')
+                return None
+            chunks.append(chunk)
+        return b''.join(chunks).decode(resp.charset or 'utf-8', errors='replace')
+
+    def enqueue(self, url, depth):
+        url = urldefrag(url)[0]
+        if self.frontier.add(url, depth):
+            self.outstanding[url] = depth
+            self.queue.put_nowait((url, depth))
+            self.count('queued')
+
+    async def worker(self, session):
+        while True:
+            url, depth = await self.queue.get()
+            if self.error:
+                self.queue.task_done()
+                continue
+            try:
+                document = await self.fetch(session, url, depth)
+                if document is not None:
+                    await self.emit(document)
+                    self.emitted[url] = [depth, document.metadata['source']]
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.count('failed')
+            except Exception as e:
+                self.count('failed')
+                print(f"爬取 {url} 失敗: {e}")
+            finally:
+                self.outstanding.pop(url, None)
+                self.queue.task_done()
+
+    async def fetch(self, session, url, depth):
+        cached = self.page_cache.get(url) if self.conditional else None
+        request_headers = {}
+        if cached and cached['etag']:
+            request_headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            request_headers['If-Modified-Since'] = cached['last_modified']
+
+        async with session.get(url, headers=request_headers) as resp:
+            if resp.status == 304 and cached:
+                self.keep(url, cached, depth)
+                return
+            if resp.status != 200:
+                self.count('failed')
+                return
+            if 'text/html' not in resp.headers.get('Content-Type', '').lower():
+                self.count('skipped')
+                return
+            html = await self.read_limited(resp)
+            headers = resp.headers
+            # relative links are resolved against the url the redirects ended at
+            base_url = str(resp.url)
+        if html is None:
+            return
+        self.count('fetched')
+
+        content_hash = hashlib.sha256(html.encode('utf-8')).hexdigest()
+        soup = BeautifulSoup(html, 'html.parser')
+        links = self.extract_links(base_url, soup)
+        if cached and cached['content_hash'] == content_hash:
+            # no validators from the server, but the body is byte for byte the same
+            self.keep(url, dict(cached, links=links), depth, headers)
+            return
+        for link in links:
+            self.enqueue(link, depth + 1)
+        if not self.frontier.indexable(url):
+            # a page rendered from database rows, which are indexed directly
+            if self.page_cache is not None:
+                self.page_cache.record(
+                    url, url, headers.get('ETag'), headers.get('Last-Modified'), content_hash, links
+                )
+            return
+
+        source = url
+        canonical = soup.find('link', rel='canonical', href=True)
+        if canonical:
+            canonical_url = urldefrag(urljoin(base_url, canonical['href']))[0]
+            canonical_key = canonicalize_url(canonical_url)
+            if canonical_key != canonicalize_url(url) and self.frontier.in_scope(canonical_key):
+                # the page is indexed once, under its canonical url
+                if not self.frontier.claim(canonical_url):
+                    return
+                source = canonical_url
+        if self.page_cache is not None:
+            self.page_cache.record(
+                url, source, headers.get('ETag'), headers.get('Last-Modified'), content_hash, links
+            )
+        return self.build_document(source, html, soup, headers)
+
+    def keep(self, url, cached, depth, headers=None):
+        # an unchanged page is not parsed again: its stored links keep the crawl
+        # going and its chunks are carried over from the current index
+        for link in cached['links']:
+            self.enqueue(link, depth + 1)
+        headers = headers or {}
+        self.page_cache.record(
+            url, cached['source'], headers.get('ETag', cached['etag']),
+            headers.get('Last-Modified', cached['last_modified']), cached['content_hash'], cached['links']
+        )
+        source = cached['source']
+        if not self.frontier.indexable(url) or (source != url and not self.frontier.claim(source)):
+            return
+        self.count('unchanged')
+        if self.on_unchanged is not None:
+            self.on_unchanged(source)
+
+    async def emit(self, document):
+        if self.on_page is None:
+            self.pages.append(document)
+            return
+        try:
+            await asyncio.to_thread(self.on_page, document)
+        except Exception as e:
+            self.error = e
+
+    @staticmethod
+    def extract_links(url, soup):
+        return [urljoin(url, a.get('href')) for a in soup.find_all('a') if a.get('href')]
+
+    @staticmethod
+    def build_document(url, html, soup, headers):
+        metadata = {'source': url}
+        if soup.title and soup.title.string:
+            metadata['title'] = soup.title.string.strip()
+        description = soup.find('meta', attrs={'name': 'description'})
+        if description and description.get('content'):
+            metadata['description'] = description.get('content')
+        if soup.html and soup.html.get('lang'):
+            metadata['language'] = soup.html.get('lang')
+        for header in ('Content-Type', 'ETag', 'Last-Modified'):
+            if header in headers:
+                metadata[header.lower().replace('-', '_')] = headers[header]
+        return Document(page_content=html, metadata=metadata)
+
+
+def crawl_website(root_url, on_page=None, **options):
+    crawler = AsyncCrawler(root_url, on_page=on_page, **options)
+    return asyncio.run(crawler.crawl())
@@ -0,0 +1,229 @@
+import time
+import threading
+from json import loads
+from queue import Queue, Empty
+
+from bs4 import BeautifulSoup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from langchain_core.documents import Document
+
+from models.member_model import Member
+from models.news_model import News
+from models.paper_model import Paper
+from models.project_model import Project, ProjectTask
+
+
+def html_to_text(html):
+    return BeautifulSoup(html or '', 'html.parser').get_text(' ', strip=True)
+
+
+def join_list(value):
+    try:
+        items = loads(value) if value else []
+    except ValueError:
+        return value
+    return ', '.join(str(item) for item in items) if isinstance(items, list) else str(items)
+
+
+def build_document(table, row, lines):
+    return Document(
+        page_content='\n'.join(line for line in lines if line),
+        metadata={
+            'source': f'{table}/{row.id}',
+            'table': table,
+            'row_id': row.id,
+            'update_time': row.update_time.strftime('%Y-%m-%d %H:%M:%S') if row.update_time else ''
+        }
+    )
+
+
+def paper_document(paper):
+    return build_document('paper', paper, [
+        f'論文 Paper: {paper.title}',
+        paper.sub_title,
+        f'作者 Authors: {join_list(paper.authors)}',
+        f'標籤 Tags: {join_list(paper.tags)}',
+        f'類型 Types: {join_list(paper.types)}',
+        f'出處 Origin: {paper.origin}' if paper.origin else '',
+        f'年份 Year: {paper.publish_year.strftime("%Y-%m")}' if paper.publish_year else '',
+        f'連結 Link: {paper.link}' if paper.link else '',
+    ])
+
+
+def news_document(news):
+    return build_document('news', news, [
+        f'消息 News: {news.title}',
+        news.sub_title,
+        html_to_text(news.content),
+    ])
+
+
+def member_document(member):
+    return build_document('member', member, [
+        f'成員 Member: {member.name} ({member.name_en})',
+        f'職位 Position: {member.position}',
+        f'畢業 Graduate: {member.graduate_year.strftime("%Y-%m")}' if member.graduate_year else '',
+        html_to_text(member.intro),
+    ])
+
+
+def project_document(project):
+    return build_document('project', project, [
+        f'計畫 Project: {project.name}',
+        html_to_text(project.description),
+        f'標籤 Tags: {join_list(project.tags)}',
+        f'成員 Members: {join_list(project.members)}',
+        f'連結 Link: {project.link}' if project.link else '',
+        f'GitHub: {project.github}' if project.github else '',
+    ])
+
+
+def project_task_document(task):
+    return build_document('project_task', task, [
+        f'計畫工作 Project task: {task.title}',
+        task.sub_title,
+        f'成員 Members: {join_list(task.members)}',
+        f'論文 Papers: {join_list(task.papers)}',
+        html_to_text(task.content),
+    ])
+
+
+def paper_attachment_document(paper, text):
+    return build_document('paper_attachment', paper, [f'論文全文 Paper full text: {paper.title}', text])
+
+
+DOCUMENT_SOURCES = {
+    'paper': (Paper, paper_document),
+    'news': (News, news_document),
+    'member': (Member, member_document),
+    'project': (Project, project_document),
+    'project_task': (ProjectTask, project_task_document),
+}
+TRACKED_MODELS = {model: table for table, (model, _) in DOCUMENT_SOURCES.items()}
+DOCUMENT_TABLES = set(DOCUMENT_SOURCES) | {'paper_attachment'}
+
+
+def attachment_documents(papers, attachments):
+    papers = [paper for paper in papers if paper.attachment_path]
+    texts = attachments.extract_many([paper.attachment_path for paper in papers])
+    for paper in papers:
+        if texts.get(paper.attachment_path):
+            yield paper_attachment_document(paper, texts[paper.attachment_path])
+
+
+def build_documents(attachments=None):
+    for model, to_document in DOCUMENT_SOURCES.values():
+        for row in model.query.all():
+            yield to_document(row)
+    if attachments is not None:
+        yield from attachment_documents(Paper.query.all(), attachments)
+
+
+class DatabaseSync:
+    # keeps the database documents of the active index in step with the tables:
+    # committed inserts, updates and deletes are queued per row and applied by a
+    # background worker, and a periodic pass compares update_time to catch
+    # anything written outside this process
+    def __init__(self, index, text_splitter, attachments=None, interval=300, on_change=None):
+        self.index = index
+        self.text_splitter = text_splitter
+        self.attachments = attachments
+        self.interval = interval
+        self.on_change = on_change
+        self.queue = Queue()
+        self.app = None
+
+    def start(self, app):
+        self.app = app
+        event.listen(Session, 'after_flush', self.collect_changes)
+        event.listen(Session, 'after_commit', self.enqueue_changes)
+        event.listen(Session, 'after_rollback', self.discard_changes)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    @staticmethod
+    def collect_changes(session, flush_context):
+        changes = session.info.setdefault('retrieval_changes', set())
+        for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+            table = TRACKED_MODELS.get(type(instance))
+            if table and instance.id is not None:
+                changes.add((table, instance.id))
+
+    def enqueue_changes(self, session):
+        for change in session.info.pop('retrieval_changes', ()):
+            self.queue.put(change)
+
+    @staticmethod
+    def discard_changes(session):
+        session.info.pop('retrieval_changes', None)
+
+    def request_reconcile(self):
+        self.queue.put(None)
+
+    def run(self):
+        # the periodic pass is due every interval seconds, however busy the queue is
+        self.safely(self.reconcile)
+        next_reconcile = time.monotonic() + self.interval
+        while True:
+            try:
+                change = self.queue.get(timeout=max(next_reconcile - time.monotonic(), 0))
+            except Empty:
+                change = None
+            if change is None:
+                self.safely(self.reconcile)
+                next_reconcile = time.monotonic() + self.interval
+            else:
+                self.safely(self.sync_row, *change)
+
+    def safely(self, func, *args):
+        try:
+            with self.app.app_context():
+                func(*args)
+        except Exception as e:
+            print(f"同步資料庫索引失敗: {e}")
+
+    def split(self, doc):
+        return self.text_splitter.split_documents([doc])
+
+    def sync_row(self, table, row_id):
+        if not self.index.embedding_matches():
+            return
+        model, to_document = DOCUMENT_SOURCES[table]
+        row = model.query.get(row_id)
+        source = f'{table}/{row_id}'
+        if row is None:
+            self.index.active.remove_source(source)
+        else:
+            self.index.active.replace_source(source, self.split(to_document(row)))
+        if table == 'paper' and self.attachments is not None:
+            docs = list(attachment_documents([row] if row else [], self.attachments))
+            self.index.active.replace_source(
+                f'paper_attachment/{row_id}', [split for doc in docs for split in self.split(doc)]
+            )
+        self.changed()
+
+    def changed(self):
+        # e.g. drops cached answers that may quote the old row
+        if self.on_change is not None:
+            self.on_change()
+
+    def reconcile(self):
+        if not self.index.embedding_matches():
+            return
+        active = self.index.active
+        stored = {}
+        for metadata in active.source_metadatas().values():
+            if metadata and metadata.get('table') in DOCUMENT_TABLES:
+                stored[metadata['source']] = metadata.get('update_time')
+
+        changed = False
+        for doc in build_documents(self.attachments):
+            source = doc.metadata['source']
+            if stored.pop(source, None) != doc.metadata['update_time']:
+                active.replace_source(source, self.split(doc))
+                changed = True
+        for source in stored:
+            active.remove_source(source)
+            changed = True
+        if changed:
+            self.changed()
@@ -0,0 +1,74 @@
+import re
+import threading
+from collections import defaultdict
+
+import mmh3
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def shingles(text, size=5):
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHashDeduplicator:
+    # drops chunks whose estimated jaccard similarity to an already kept chunk
+    # reaches the threshold; signatures are bucketed per band (LSH) so each
+    # chunk is only compared against the few kept chunks sharing a band with it
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.buckets = defaultdict(list)
+        self.signatures = []
+        self.chunks = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    def signature(self, text):
+        hashes = np.array(
+            [mmh3.hash(shingle, signed=False) for shingle in shingles(text, self.shingle_size)], dtype=np.uint64
+        )
+        return ((self.a[:, None] * hashes[None, :] % MERSENNE_PRIME + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    def band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def is_duplicate(self, text):
+        signature = self.signature(text)
+        keys = self.band_keys(signature)
+        with self.lock:
+            self.chunks += 1
+            candidates = {i for key in keys for i in self.buckets.get(key, ())}
+            for i in candidates:
+                if np.mean(self.signatures[i] == signature) >= self.threshold:
+                    self.duplicates += 1
+                    return True
+            self.keep(signature, keys)
+            return False
+
+    def remember(self, text):
+        # registers a chunk kept by an earlier run without counting it
+        signature = self.signature(text)
+        with self.lock:
+            self.keep(signature, self.band_keys(signature))
+
+    def keep(self, signature, keys):
+        for key in keys:
+            self.buckets[key].append(len(self.signatures))
+        self.signatures.append(signature)
+
+    def __call__(self, doc):
+        return [] if self.is_duplicate(doc.page_content) else [doc]
+
+    def stats(self):
+        with self.lock:
+            return {'chunks': self.chunks, 'duplicates': self.duplicates}
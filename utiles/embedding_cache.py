@@ -0,0 +1,95 @@
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embedding, model_name, cache_path, batch_size=256, max_batch_chars=200000):
+        self.embedding = embedding
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, vector BLOB)')
+        self.conn.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def lookup(self, keys):
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def store(self, items):
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO embedding_cache (key, vector) VALUES (?, ?)',
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+            self.conn.commit()
+
+    def batches(self, items):
+        batch, batch_chars = [], 0
+        for key, text in items:
+            if batch and (len(batch) >= self.batch_size or batch_chars + len(text) > self.max_batch_chars):
+                yield batch
+                batch, batch_chars = [], 0
+            batch.append((key, text))
+            batch_chars += len(text)
+        if batch:
+            yield batch
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        keys = [self.key(text) for text in texts]
+        vectors = self.lookup(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        for batch in self.batches(missing.items()):
+            batch_vectors = self.embedding.embed_documents([text for _, text in batch])
+            items = [(key, vector) for (key, _), vector in zip(batch, batch_vectors)]
+            self.store(items)
+            vectors.update(items)
+
+        with self.lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            self.seconds += time.perf_counter() - start
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embedding.embed_query(text)
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.seconds = 0.0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'seconds': round(self.seconds, 3)}
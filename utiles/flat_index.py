@@ -0,0 +1,273 @@
+import os
+import gzip
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def quantize(vectors, dtype):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if dtype == 'int8':
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(np.float16), None
+
+
+class FlatVectorStore:
+    # the whole collection is one quantized matrix of unit vectors in a .npy file
+    # that is memory mapped, so workers share its pages through the OS cache and
+    # a query is a single matrix product; writes produce a new generation of the
+    # files and switch to it by replacing meta.json. Workers share the directory,
+    # so the first change takes a file lock and reloads the latest generation, and
+    # the lock is held until persist() has written the next one
+    def __init__(self, directory, embedding, dtype='float16', embedding_name=None, block_size=8192):
+        self.directory = Path(directory)
+        self.embedding = embedding
+        self.block_size = block_size
+        self.lock = threading.RLock()
+        self.write_lock = threading.RLock()
+        self.lock_file = None
+        self.meta_path = self.directory / 'meta.json'
+        self.meta = {'embedding': embedding_name, 'dtype': dtype, 'generation': 0}
+        self.mtime = None
+        self.clear()
+        if self.meta_path.exists():
+            self.load()
+
+    def clear(self):
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.positions = {}
+        self.vectors = None
+        self.scales = None
+
+    def path(self, name, generation):
+        return self.directory / f'{name}-{generation}.npy'
+
+    def load(self):
+        with self.lock:
+            self.mtime = self.meta_path.stat().st_mtime_ns
+            self.meta = json.loads(self.meta_path.read_text())
+            generation = self.meta['generation']
+            with gzip.open(self.directory / f'records-{generation}.json.gz', 'rt', encoding='utf-8') as f:
+                records = json.load(f)
+            self.ids, self.documents, self.metadatas = records['ids'], records['documents'], records['metadatas']
+            self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            self.vectors = np.load(self.path('vectors', generation), mmap_mode='r') if self.ids else None
+            scales_path = self.path('scales', generation)
+            self.scales = np.load(scales_path) if self.ids and scales_path.exists() else None
+
+    def refresh(self):
+        # picks up writes made by another worker sharing the directory
+        try:
+            mtime = self.meta_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            self.load()
+
+    def begin_write(self):
+        with self.write_lock:
+            if self.lock_file is not None:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            lock_file = open(self.directory / 'write.lock', 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.lock_file = lock_file
+            self.refresh()
+
+    def end_write(self):
+        self.lock_file.close()
+        self.lock_file = None
+
+    @contextmanager
+    def transaction(self):
+        self.begin_write()
+        try:
+            yield
+        except BaseException:
+            self.abort()
+            raise
+        self.persist()
+
+    def abort(self):
+        # throws the unsaved changes away and lets other workers write again
+        with self.write_lock:
+            if self.lock_file is None:
+                return
+            with self.lock:
+                self.mtime = None
+                if self.meta_path.exists():
+                    self.load()
+                else:
+                    self.clear()
+            self.end_write()
+
+    def write_file(self, path, write):
+        # files are never rewritten in place, other workers may have the old ones memory mapped
+        tmp_path = path.with_name(path.name + '.tmp')
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def save_array(self, name, generation, array):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+        self.write_file(self.path(name, generation), write)
+
+    def save_records(self, generation):
+        def write(tmp_path):
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(
+                    {'ids': self.ids, 'documents': self.documents, 'metadatas': self.metadatas},
+                    f, ensure_ascii=False, separators=(',', ':')
+                )
+        self.write_file(self.directory / f'records-{generation}.json.gz', write)
+
+    def persist(self):
+        with self.write_lock:
+            if self.lock_file is None:
+                # nothing changed since the last persist, but a new store still writes its first generation
+                if self.meta_path.exists():
+                    return
+                self.begin_write()
+            try:
+                with self.lock:
+                    retired = self.meta['generation'] - 1
+                    generation = self.meta['generation'] + 1
+                    if self.ids:
+                        self.save_array('vectors', generation, self.vectors)
+                        if self.scales is not None:
+                            self.save_array('scales', generation, self.scales)
+                    self.save_records(generation)
+                    meta = dict(self.meta, generation=generation)
+                    self.write_file(self.meta_path, lambda tmp_path: tmp_path.write_text(json.dumps(meta)))
+                    # the previous generation stays for readers that have not switched yet
+                    for name in (f'vectors-{retired}.npy', f'scales-{retired}.npy', f'records-{retired}.json.gz'):
+                        (self.directory / name).unlink(missing_ok=True)
+                    self.load()
+            finally:
+                self.end_write()
+
+    def embedding_name(self):
+        return self.meta.get('embedding')
+
+    def count(self):
+        return len(self.ids)
+
+    def stored_ids(self, source=None):
+        with self.lock:
+            if source is None:
+                return list(self.ids)
+            return [doc_id for doc_id, metadata in zip(self.ids, self.metadatas) if metadata.get('source') == source]
+
+    def source_metadatas(self):
+        with self.lock:
+            return dict(zip(self.ids, self.metadatas))
+
+    def records(self, ids):
+        with self.lock:
+            positions = [self.positions[doc_id] for doc_id in ids if doc_id in self.positions]
+            embeddings = np.asarray(self.vectors[positions], dtype=np.float32) if positions else []
+            if self.scales is not None and positions:
+                embeddings *= self.scales[positions][:, None]
+            return {
+                'ids': [self.ids[i] for i in positions],
+                'embeddings': [list(vector) for vector in embeddings],
+                'documents': [self.documents[i] for i in positions],
+                'metadatas': [self.metadatas[i] for i in positions],
+            }
+
+    def add_documents(self, docs, ids):
+        embeddings = self.embedding.embed_documents([doc.page_content for doc in docs])
+        self.upsert(ids, embeddings, [doc.page_content for doc in docs], [doc.metadata for doc in docs])
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors, scales = quantize(embeddings, self.meta['dtype'])
+        self.begin_write()
+        with self.lock:
+            self.vectors = np.array(self.vectors) if self.vectors is not None else vectors[:0]
+            appended = []
+            for row, doc_id in enumerate(ids):
+                position = self.positions.get(doc_id)
+                if position is None:
+                    appended.append(row)
+                    self.positions[doc_id] = len(self.ids)
+                    self.ids.append(doc_id)
+                    self.documents.append(documents[row])
+                    self.metadatas.append(metadatas[row] or {})
+                else:
+                    self.vectors[position] = vectors[row]
+                    if scales is not None:
+                        self.scales[position] = scales[row]
+                    self.documents[position] = documents[row]
+                    self.metadatas[position] = metadatas[row] or {}
+            self.vectors = np.concatenate([self.vectors, vectors[appended]])
+            if scales is not None:
+                current = self.scales if self.scales is not None else scales[:0]
+                self.scales = np.concatenate([current, scales[appended]])
+
+    def update_metadatas(self, ids, metadatas):
+        self.begin_write()
+        with self.lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                if doc_id in self.positions:
+                    self.metadatas[self.positions[doc_id]] = metadata
+
+    def delete(self, ids):
+        self.begin_write()
+        with self.lock:
+            removed = {self.positions[doc_id] for doc_id in ids if doc_id in self.positions}
+            if not removed:
+                return
+            keep = [i for i in range(len(self.ids)) if i not in removed]
+            self.vectors = np.asarray(self.vectors)[keep]
+            if self.scales is not None:
+                self.scales = self.scales[keep]
+            self.ids = [self.ids[i] for i in keep]
+            self.documents = [self.documents[i] for i in keep]
+            self.metadatas = [self.metadatas[i] for i in keep]
+            self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    def similarity_search(self, query, k=4):
+        self.refresh()
+        query_vector = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        query_vector /= max(np.linalg.norm(query_vector), 1e-12)
+        with self.lock:
+            vectors, scales, documents, metadatas = self.vectors, self.scales, self.documents, self.metadatas
+        if vectors is None or not len(vectors):
+            return []
+
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), self.block_size):
+            block = vectors[start:start + self.block_size]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        if scales is not None:
+            scores *= scales
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [Document(page_content=documents[i], metadata=metadatas[i]) for i in top]
+
+    def as_retriever(self, k=4):
+        return FlatRetriever(store=self, k=k)
+
+
+class FlatRetriever(BaseRetriever):
+    store: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        return self.store.similarity_search(query, k=self.k)
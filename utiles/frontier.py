@@ -0,0 +1,92 @@
+import posixpath
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+
+TRACKING_PARAMS = {'fbclid', 'gclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', 'spm'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    # page#section, page?utm_source=... and page/ all map to the same key; the key
+    # is only used to recognise pages already seen, pages are fetched under their own url
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+
+    path = '/' + posixpath.normpath(parts.path or '/').lstrip('/')
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+class UrlFrontier:
+    # decides which urls get fetched: every url is canonicalized before the
+    # seen check, and scope, robots.txt, depth and page budgets are all applied here
+    def __init__(self, root_url, max_depth=5, max_pages=2000, user_agent='*', on_skip=None, skip_index_paths=()):
+        self.root_url = canonicalize_url(root_url)
+        self.skip_index_paths = ['/' + path.strip('/') for path in skip_index_paths]
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.user_agent = user_agent
+        self.on_skip = on_skip
+        self.robots = RobotFileParser()
+        self.robots.parse([])
+        self.robots_text = ''
+        self.seen = set()
+        self.skipped = {'robots': 0, 'depth': 0, 'budget': 0}
+
+    def set_robots(self, text):
+        self.robots = RobotFileParser()
+        self.robots.parse(text.splitlines())
+        self.robots_text = text
+
+    def state(self):
+        return {'seen': list(self.seen), 'skipped': dict(self.skipped), 'robots': self.robots_text}
+
+    def restore(self, state):
+        self.set_robots(state['robots'])
+        self.seen = set(state['seen'])
+        self.skipped = state['skipped']
+
+    def sitemaps(self):
+        return self.robots.site_maps() or []
+
+    def in_scope(self, url):
+        prefix = self.root_url.rstrip('/')
+        return url == prefix or url.startswith((prefix + '/', prefix + '?'))
+
+    def indexable(self, url):
+        path = urlsplit(canonicalize_url(url)).path
+        return not any(path == prefix or path.startswith(prefix.rstrip('/') + '/') for prefix in self.skip_index_paths)
+
+    def add(self, url, depth):
+        key = canonicalize_url(url)
+        if key in self.seen or not self.in_scope(key):
+            return False
+        if depth > self.max_depth:
+            return self.skip('depth')
+        if not self.robots.can_fetch(self.user_agent, url):
+            return self.skip('robots')
+        if len(self.seen) >= self.max_pages:
+            return self.skip('budget')
+        self.seen.add(key)
+        return True
+
+    def skip(self, reason):
+        self.skipped[reason] += 1
+        if self.on_skip is not None:
+            self.on_skip(reason)
+        return False
+
+    def claim(self, url):
+        # a page naming another url as rel=canonical is only kept if that url
+        # has not been (and will not be) fetched on its own
+        key = canonicalize_url(url)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
@@ -0,0 +1,402 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from datetime import datetime
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from utiles.flat_index import FlatVectorStore
+from utiles.keyword_index import BM25Index, HybridRetriever, KeywordRetriever
+
+
+def chunk_id(doc):
+    content = f"{doc.metadata.get('source', '')}\n{doc.page_content}"
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ChromaStore:
+    def __init__(self, client, embedding, collection_name, embedding_name=None):
+        self.vectorstore = Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding,
+            client=client,
+            # only set on new collections, chroma overwrites the metadata of existing ones
+            collection_metadata={'embedding': embedding_name} if embedding_name else None
+        )
+        self.collection = self.vectorstore._collection
+
+    def embedding_name(self):
+        return (self.collection.metadata or {}).get('embedding')
+
+    def count(self):
+        return self.collection.count()
+
+    def stored_ids(self, source=None):
+        return self.vectorstore.get(where={'source': source} if source else None, include=[])['ids']
+
+    def source_metadatas(self):
+        stored = self.vectorstore.get(include=['metadatas'])
+        return dict(zip(stored['ids'], stored['metadatas']))
+
+    def records(self, ids):
+        return self.collection.get(ids=ids, include=['embeddings', 'documents', 'metadatas'])
+
+    def add_documents(self, docs, ids):
+        self.vectorstore.add_documents(docs, ids=ids)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update_metadatas(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.vectorstore.delete(ids=ids)
+
+    def persist(self):
+        pass
+
+    def transaction(self):
+        return nullcontext()
+
+    def as_retriever(self, k=4):
+        return self.vectorstore.as_retriever(search_kwargs={'k': k})
+
+
+class IncrementalIndex:
+    def __init__(self, store, collection_name, batch_size=1000, base=None, keyword_path=None):
+        self.store = store
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.base = base
+        self.keyword_path = keyword_path
+        self.keyword_mtime = None
+        self.keyword_index = BM25Index()
+        self.refresh_keywords()
+
+    def as_retriever(self, k=4, keyword_weight=0.5):
+        return HybridRetriever(
+            retrievers=[self.store.as_retriever(k=k), KeywordRetriever(index=self.keyword_index, k=k)],
+            weights=[1 - keyword_weight, keyword_weight],
+            k=k
+        )
+
+    def embedding_name(self):
+        return self.store.embedding_name()
+
+    def keyword_file_mtime(self):
+        try:
+            return Path(self.keyword_path).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh_keywords(self):
+        # picks up keyword index changes another worker saved for this collection
+        if not self.keyword_path:
+            return False
+        mtime = self.keyword_file_mtime()
+        if mtime is None or mtime == self.keyword_mtime:
+            return False
+        self.keyword_index.reload(self.keyword_path)
+        self.keyword_mtime = mtime
+        return True
+
+    def save_keywords(self):
+        if self.keyword_path:
+            self.keyword_index.save(self.keyword_path)
+            self.keyword_mtime = self.keyword_file_mtime()
+
+    @contextmanager
+    def keyword_transaction(self):
+        # every worker edits the keyword index of the live collection, so an edit
+        # starts from the latest saved file and is saved while the file lock is held
+        if not self.keyword_path:
+            yield
+            return
+        lock_path = Path(f'{self.keyword_path}.lock')
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.refresh_keywords()
+            yield
+            self.save_keywords()
+
+    def is_empty(self):
+        return self.store.count() == 0
+
+    def stored_ids(self):
+        return set(self.store.stored_ids())
+
+    def begin(self):
+        self.existing_ids = (self.base or self).stored_ids()
+        self.seen_ids = set()
+        self.stats = {'added': 0, 'deleted': 0, 'unchanged': 0}
+
+    def resume(self, sources):
+        # continues a build from a checkpoint: chunks of sources that were not
+        # completely indexed are dropped so those sources can be indexed again,
+        # whatever else the collection holds counts as added
+        sources = set(sources)
+        partial_ids = [
+            doc_id for doc_id, metadata in self.source_metadatas().items()
+            if (metadata or {}).get('source') not in sources
+        ]
+        for i in range(0, len(partial_ids), self.batch_size):
+            self.store.delete(ids=partial_ids[i:i + self.batch_size])
+        for doc_id in partial_ids:
+            self.keyword_index.remove(doc_id)
+
+        stored_ids = self.stored_ids()
+        self.existing_ids = self.base.stored_ids() if self.base is not None else set(stored_ids)
+        self.seen_ids = set(stored_ids)
+        self.stats = {'added': 0, 'deleted': 0, 'unchanged': 0}
+        missing_ids = [doc_id for doc_id in stored_ids if doc_id not in self.keyword_index.documents]
+        for i in range(0, len(missing_ids), self.batch_size):
+            stored = self.store.records(missing_ids[i:i + self.batch_size])
+            for doc_id, content, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+                self.keyword_index.add(doc_id, Document(page_content=content, metadata=metadata or {}))
+
+    def checkpoint(self):
+        self.store.persist()
+        self.save_keywords()
+
+    def add(self, splits):
+        docs_by_id = {}
+        unchanged_ids = []
+        for doc in splits:
+            doc_id = chunk_id(doc)
+            if doc_id in self.seen_ids:
+                continue
+            self.seen_ids.add(doc_id)
+            self.keyword_index.add(doc_id, doc)
+            if doc_id in self.existing_ids:
+                unchanged_ids.append(doc_id)
+            else:
+                docs_by_id[doc_id] = doc
+
+        new_ids = list(docs_by_id)
+        for i in range(0, len(new_ids), self.batch_size):
+            batch_ids = new_ids[i:i + self.batch_size]
+            self.store.add_documents([docs_by_id[doc_id] for doc_id in batch_ids], ids=batch_ids)
+
+        if self.base is not None:
+            for i in range(0, len(unchanged_ids), self.batch_size):
+                self.copy_from_base(unchanged_ids[i:i + self.batch_size])
+
+        self.stats['added'] += len(new_ids)
+        self.stats['unchanged'] += len(unchanged_ids)
+
+    def keep_source(self, source):
+        # carries the chunks of a page that did not change over from the base
+        if self.base is None:
+            return 0
+        ids = [doc_id for doc_id in self.base.store.stored_ids(source) if doc_id not in self.seen_ids]
+        for doc_id in ids:
+            self.seen_ids.add(doc_id)
+            doc = self.base.keyword_index.documents.get(doc_id)
+            if doc is not None:
+                self.keyword_index.add(doc_id, doc)
+        for i in range(0, len(ids), self.batch_size):
+            self.copy_from_base(ids[i:i + self.batch_size])
+        self.stats['unchanged'] += len(ids)
+        return len(ids)
+
+    def base_chunks(self, source):
+        if self.base is None:
+            return []
+        documents = self.base.keyword_index.documents
+        return [documents[doc_id] for doc_id in self.base.store.stored_ids(source) if doc_id in documents]
+
+    def copy_from_base(self, ids):
+        stored = self.base.store.records(ids)
+        self.store.upsert(
+            ids=stored['ids'],
+            embeddings=stored['embeddings'],
+            documents=stored['documents'],
+            metadatas=stored['metadatas']
+        )
+
+    def finish(self):
+        stale_ids = list(self.existing_ids - self.seen_ids)
+        if self.base is None:
+            for i in range(0, len(stale_ids), self.batch_size):
+                self.store.delete(ids=stale_ids[i:i + self.batch_size])
+            for doc_id in stale_ids:
+                self.keyword_index.remove(doc_id)
+        self.store.persist()
+        self.save_keywords()
+        self.stats['deleted'] = len(stale_ids)
+        return self.stats
+
+    def source_metadatas(self):
+        return self.store.source_metadatas()
+
+    def replace_source(self, source, splits):
+        # swaps the chunks of one source (e.g. a database row) in place; chunks whose
+        # text did not change keep their vectors and only get the new metadata
+        # the live collection is shared with other workers, inside the transaction
+        # the store holds their latest changes and writes on top of them
+        docs_by_id = {chunk_id(doc): doc for doc in splits}
+        with self.store.transaction():
+            old_ids = set(self.store.stored_ids(source))
+            new_ids = [doc_id for doc_id in docs_by_id if doc_id not in old_ids]
+            kept_ids = [doc_id for doc_id in docs_by_id if doc_id in old_ids]
+            stale_ids = list(old_ids - docs_by_id.keys())
+            if new_ids:
+                self.store.add_documents([docs_by_id[doc_id] for doc_id in new_ids], ids=new_ids)
+            if kept_ids:
+                self.store.update_metadatas(kept_ids, [docs_by_id[doc_id].metadata for doc_id in kept_ids])
+            if stale_ids:
+                self.store.delete(ids=stale_ids)
+
+        with self.keyword_transaction():
+            for doc_id in stale_ids:
+                self.keyword_index.remove(doc_id)
+            for doc_id, doc in docs_by_id.items():
+                self.keyword_index.add(doc_id, doc)
+
+    def remove_source(self, source):
+        self.replace_source(source, [])
+
+    def sync(self, splits):
+        self.begin()
+        self.add(splits)
+        return self.finish()
+
+
+class BlueGreenIndex:
+    # rebuilds go into a fresh shadow collection seeded from the live one; the
+    # live collection keeps serving until the shadow is promoted, and the
+    # collection it replaced is kept around so it can be rolled back to
+    def __init__(
+            self, persist_directory, embedding, collection_prefix='widm', batch_size=1000, embedding_name=None,
+            backend='chroma', dtype='float16'
+    ):
+        self.embedding = embedding
+        self.embedding_name = embedding_name
+        self.collection_prefix = collection_prefix
+        self.batch_size = batch_size
+        self.backend = backend
+        self.dtype = dtype
+        self.state_path = Path(persist_directory) / 'collections.json'
+        self.keyword_directory = Path(persist_directory) / 'keyword'
+        self.flat_directory = Path(persist_directory) / 'flat'
+        self.client = None
+        if backend == 'chroma':
+            import chromadb
+            self.client = chromadb.PersistentClient(path=persist_directory)
+        self.lock = threading.Lock()
+
+        self.state_mtime = None
+        state = {'active': collection_prefix, 'previous': None}
+        if self.state_path.exists():
+            self.state_mtime = self.state_path.stat().st_mtime_ns
+            state = json.loads(self.state_path.read_text())
+        self.active = self.open(state['active'])
+        if self.active.is_empty() and self.active.embedding_name() is None:
+            # a new collection is tagged with the configured embedding
+            self.active = self.open(state['active'], embedding_name=embedding_name)
+        self.previous = state['previous']
+
+    def open(self, collection_name, base=None, embedding_name=None):
+        if self.backend == 'flat':
+            store = FlatVectorStore(
+                self.flat_directory / collection_name, self.embedding, dtype=self.dtype, embedding_name=embedding_name
+            )
+        else:
+            store = ChromaStore(self.client, self.embedding, collection_name, embedding_name=embedding_name)
+        return IncrementalIndex(
+            store, collection_name, batch_size=self.batch_size, base=base,
+            keyword_path=self.keyword_directory / f'{collection_name}.json.gz'
+        )
+
+    def save_state(self):
+        tmp_path = self.state_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'active': self.active.collection_name, 'previous': self.previous}))
+        os.replace(tmp_path, self.state_path)
+        self.state_mtime = self.state_path.stat().st_mtime_ns
+
+    def refresh(self):
+        # picks up a collection promoted by another worker sharing the directory
+        try:
+            state_mtime = self.state_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if state_mtime == self.state_mtime:
+            return False
+
+        with self.lock:
+            self.state_mtime = state_mtime
+            state = json.loads(self.state_path.read_text())
+            self.previous = state['previous']
+            if state['active'] == self.active.collection_name:
+                return False
+            self.active = self.open(state['active'])
+            return True
+
+    def embedding_matches(self):
+        # vectors of another embedding backend have another dimension: such a
+        # collection can neither be queried nor written to until a rebuild replaces it
+        return self.active.embedding_name() == self.embedding_name
+
+    def is_servable(self):
+        return self.embedding_matches() and not self.active.is_empty()
+
+    def create_shadow(self):
+        collection_name = f"{self.collection_prefix}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        # vectors can only be reused from a collection built with the same embedding
+        base = self.active if self.embedding_matches() else None
+        return self.open(collection_name, base=base, embedding_name=self.embedding_name)
+
+    def resume_shadow(self, collection_name, base_name):
+        # a checkpointed build can only go on while the collection it was seeded
+        # from is still the live one and the embedding has not changed
+        if base_name is not None and base_name != self.active.collection_name:
+            return None
+        base = self.active if base_name is not None else None
+        shadow = self.open(collection_name, base=base)
+        if shadow.is_empty():
+            return self.open(collection_name, base=base, embedding_name=self.embedding_name)
+        if shadow.embedding_name() != self.embedding_name:
+            return None
+        return shadow
+
+    def promote(self, shadow):
+        with self.lock:
+            retired = self.previous
+            self.previous = self.active.collection_name
+            self.active = shadow
+            shadow.base = None
+            self.save_state()
+        if retired:
+            self.drop(retired)
+
+    def discard(self, shadow):
+        self.drop(shadow.collection_name)
+
+    def rollback(self):
+        with self.lock:
+            if not self.previous:
+                return False
+            current = self.active.collection_name
+            self.active = self.open(self.previous)
+            self.previous = current
+            self.save_state()
+            return True
+
+    def drop(self, collection_name):
+        if self.backend == 'flat':
+            shutil.rmtree(self.flat_directory / collection_name, ignore_errors=True)
+        else:
+            try:
+                self.client.delete_collection(collection_name)
+            except ValueError:
+                pass
+        (self.keyword_directory / f'{collection_name}.json.gz').unlink(missing_ok=True)
+        (self.keyword_directory / f'{collection_name}.json.gz.lock').unlink(missing_ok=True)
@@ -0,0 +1,151 @@
+import re
+import gzip
+import json
+import math
+import heapq
+import threading
+from pathlib import Path
+from collections import Counter, defaultdict
+from typing import Any, List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[㐀-鿿]+')
+
+
+def tokenize(text):
+    # latin words and numbers are kept whole so names, student ids and course
+    # codes match exactly; runs of CJK characters are split into bigrams
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token.isascii() or len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = {}
+        self.term_freqs = {}
+        self.doc_lengths = {}
+        self.postings = defaultdict(set)
+        self.total_length = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id, doc):
+        term_freqs = Counter(tokenize(doc.page_content))
+        with self.lock:
+            self.remove(doc_id)
+            self.index(doc_id, doc, term_freqs)
+
+    def index(self, doc_id, doc, term_freqs):
+        self.documents[doc_id] = doc
+        self.term_freqs[doc_id] = term_freqs
+        self.doc_lengths[doc_id] = sum(term_freqs.values())
+        self.total_length += self.doc_lengths[doc_id]
+        for term in term_freqs:
+            self.postings[term].add(doc_id)
+
+    def remove(self, doc_id):
+        with self.lock:
+            if doc_id not in self.documents:
+                return
+            for term in self.term_freqs[doc_id]:
+                self.postings[term].discard(doc_id)
+                if not self.postings[term]:
+                    del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            del self.documents[doc_id]
+            del self.term_freqs[doc_id]
+
+    def search(self, query, k=4):
+        with self.lock:
+            return self.score(query, k)
+
+    def score(self, query, k):
+        if not self.documents:
+            return []
+
+        doc_count = len(self.documents)
+        average_length = self.total_length / doc_count or 1
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            doc_ids = self.postings.get(term)
+            if not doc_ids:
+                continue
+            idf = math.log(1 + (doc_count - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            for doc_id in doc_ids:
+                tf = self.term_freqs[doc_id][term]
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / average_length
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [self.documents[doc_id] for doc_id, _ in top]
+
+    def save(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            payload = {
+                doc_id: [doc.page_content, doc.metadata, self.term_freqs[doc_id]]
+                for doc_id, doc in self.documents.items()
+            }
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        Path(tmp_path).replace(path)
+
+    @classmethod
+    def load(cls, path):
+        bm25 = cls()
+        bm25.reload(path)
+        return bm25
+
+    def reload(self, path):
+        # replaces the contents in place, so retrievers holding this index see them
+        if not Path(path).exists():
+            return
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        with self.lock:
+            self.documents, self.term_freqs, self.doc_lengths = {}, {}, {}
+            self.postings = defaultdict(set)
+            self.total_length = 0
+            for doc_id, (page_content, metadata, term_freqs) in payload.items():
+                self.index(doc_id, Document(page_content=page_content, metadata=metadata), Counter(term_freqs))
+
+
+class KeywordRetriever(BaseRetriever):
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        return self.index.search(query, k=self.k)
+
+
+class HybridRetriever(BaseRetriever):
+    # fuses the ranked lists with reciprocal rank fusion, so the scores of the
+    # two retrievers never have to be calibrated against each other
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    k: int = 4
+    c: int = 60
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        scores = defaultdict(float)
+        documents = {}
+        for retriever, weight in zip(self.retrievers, self.weights):
+            for rank, doc in enumerate(retriever.invoke(query), start=1):
+                key = (doc.metadata.get('source'), doc.page_content)
+                documents.setdefault(key, doc)
+                scores[key] += weight / (rank + self.c)
+
+        top = heapq.nlargest(self.k, scores.items(), key=lambda item: item[1])
+        return [documents[key] for key, _ in top]
@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import openai
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+# errors worth another attempt, anything else (bad request, auth) fails at once
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class LlmWorkerPool:
+    # at most max_workers llm calls run at once and at most max_queue wait for a
+    # worker; anything beyond that is rejected right away, so a burst of chatbot
+    # traffic cannot occupy the server threads that serve the rest of the api
+    def __init__(self, max_workers=4, max_queue=16, timeout=90, max_retries=2, max_backoff=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.counters = {'accepted': 0, 'rejected': 0, 'timed_out': 0, 'retried': 0, 'failed': 0}
+        self.in_flight = 0
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def call(self, func, args, kwargs, can_retry):
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_retries + 1),
+            wait=wait_random_exponential(multiplier=0.5, max=self.max_backoff),
+            retry=retry_if_exception(lambda e: isinstance(e, TRANSIENT_ERRORS) and (can_retry is None or can_retry())),
+            before_sleep=lambda retry_state: self.count('retried'),
+            reraise=True
+        )
+        try:
+            return retrying(func, *args, **kwargs)
+        except Exception:
+            self.count('failed')
+            raise
+
+    def release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def submit(self, func, *args, can_retry=None, **kwargs):
+        # can_retry lets a streaming caller stop retrying once tokens went out
+        if not self.slots.acquire(blocking=False):
+            self.count('rejected')
+            raise PoolSaturated('llm worker pool is saturated')
+        with self.lock:
+            self.in_flight += 1
+            self.counters['accepted'] += 1
+        try:
+            future = self.executor.submit(self.call, func, args, kwargs, can_retry)
+        except Exception:
+            self.release(None)
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def result(self, future):
+        # the slot stays taken until the worker really finishes, a timed out
+        # call still counts against the pool while it runs
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # concurrent.futures.TimeoutError is not the builtin one before python 3.11
+            future.cancel()
+            self.count('timed_out')
+            raise PoolTimeout('llm call timed out') from None
+
+    def run(self, func, *args, **kwargs):
+        return self.result(self.submit(func, *args, **kwargs))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=self.in_flight)
@@ -0,0 +1,65 @@
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utiles.keyword_index import tokenize
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class OnnxEmbeddings(Embeddings):
+    # sentence-transformer style model exported to onnx: token embeddings are
+    # mean pooled over the attention mask and L2 normalized, one padded batch at a time
+    def __init__(self, model_path, tokenizer_path, batch_size=32, max_length=512, threads=0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        output = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        if output.ndim == 3:
+            mask = inputs['attention_mask'][:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return normalize(output.astype(np.float32))
+
+    def embed_documents(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self.encode(texts[i:i + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+class HashingEmbeddings(Embeddings):
+    # needs no model files and no fitting: the keyword tokens are hashed into a
+    # fixed number of buckets, so vectors stay comparable across rebuilds
+    def __init__(self, n_features=1024):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, analyzer=tokenize, alternate_sign=False, norm='l2'
+        )
+
+    def embed_documents(self, texts):
+        return self.vectorizer.transform(texts).toarray().astype(np.float32).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,203 @@
+import json
+import time
+import zlib
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    Column, DateTime, Integer, LargeBinary, MetaData, String, Table, and_, create_engine, delete, insert, or_, select
+)
+from sqlalchemy.exc import DataError, IntegrityError
+
+
+def approximate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class Session:
+    __slots__ = ('value', 'last_active', 'tokens')
+
+    def __init__(self, value, last_active):
+        self.value = value
+        self.last_active = last_active
+        self.tokens = 0
+
+
+class SessionStore:
+    # sessions are kept in least-recently-used order, and since every access also
+    # refreshes the TTL the expired sessions are always at the front, so both
+    # expiry and eviction pop from the head without scanning the whole store
+    def __init__(self, factory, ttl=300, max_sessions=1000, max_tokens=2000000, token_counter=approximate_tokens):
+        self.factory = factory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter
+        self.sessions = OrderedDict()
+        self.total_tokens = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            self.expire_before(now - self.ttl)
+            session = self.sessions.get(user_id)
+            if session is None:
+                session = Session(self.factory(), now)
+                self.sessions[user_id] = session
+                self.evict()
+            else:
+                self.sessions.move_to_end(user_id)
+                session.last_active = now
+            return session.value
+
+    def resize(self, user_id, texts):
+        tokens = sum(self.token_counter(text) for text in texts)
+        with self.lock:
+            session = self.sessions.get(user_id)
+            if session is None:
+                return
+            self.total_tokens += tokens - session.tokens
+            session.tokens = tokens
+            self.evict()
+
+    def expire(self):
+        with self.lock:
+            return self.expire_before(time.monotonic() - self.ttl)
+
+    def expire_before(self, deadline):
+        expired = 0
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_active > deadline:
+                break
+            self.pop_oldest()
+            expired += 1
+        return expired
+
+    def evict(self):
+        while len(self.sessions) > self.max_sessions or (self.total_tokens > self.max_tokens and len(self.sessions) > 1):
+            self.pop_oldest()
+
+    def pop_oldest(self):
+        _, session = self.sessions.popitem(last=False)
+        self.total_tokens -= session.tokens
+
+
+class SqlSessionBackend:
+    # histories are written behind: saves are buffered and flushed in one
+    # transaction per interval, and every worker reads a session back only when
+    # the stored version is newer than the copy it already holds
+    def __init__(self, url, flush_interval=1.0, batch_size=100):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.table = Table(
+            'chat_session', MetaData(),
+            Column('user_id', String(255), primary_key=True),
+            Column('version', Integer, nullable=False),
+            Column('history', LargeBinary, nullable=False),
+            Column('update_time', DateTime, nullable=False, index=True),
+        )
+        self.table.metadata.create_all(self.engine)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_event = threading.Event()
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def session_key(user_id):
+        # person_id comes straight from the query string, hashing it bounds the key length
+        return hashlib.sha256(user_id.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def encode(history):
+        return zlib.compress(json.dumps(history, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def decode(payload):
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    def load_if_newer(self, user_id, version):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.table.c.version, self.table.c.history).where(
+                    self.table.c.user_id == self.session_key(user_id), self.table.c.version > version
+                )
+            ).first()
+        if row is None:
+            return None
+        return row.version, self.decode(row.history)
+
+    def save(self, user_id, version, history):
+        user_id = self.session_key(user_id)
+        with self.lock:
+            self.pending[user_id] = {
+                'user_id': user_id,
+                'version': version,
+                'history': self.encode(history),
+                'update_time': datetime.now()
+            }
+            if len(self.pending) >= self.batch_size:
+                self.flush_event.set()
+
+    def flush_loop(self):
+        while True:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"寫入對話紀錄失敗: {e}")
+
+    def flush(self):
+        with self.lock:
+            rows, self.pending = list(self.pending.values()), {}
+        if not rows:
+            return
+        try:
+            with self.engine.begin() as conn:
+                self.write(conn, rows)
+        except (DataError, IntegrityError):
+            # a row the database refuses, or one another worker raced us on, must not
+            # hold back the batch forever: every row is written on its own and dropped if it fails
+            for row in rows:
+                try:
+                    with self.engine.begin() as conn:
+                        self.write(conn, [row])
+                except (DataError, IntegrityError) as e:
+                    print(f"寫入對話紀錄失敗 {row['user_id']}: {e}")
+        except Exception:
+            with self.lock:
+                for row in rows:
+                    self.pending.setdefault(row['user_id'], row)
+            raise
+
+    def write(self, conn, rows):
+        # a buffered history only replaces an older version, never a newer one another worker stored
+        stored = dict(conn.execute(
+            select(self.table.c.user_id, self.table.c.version).where(
+                self.table.c.user_id.in_([row['user_id'] for row in rows])
+            )
+        ).all())
+        rows = [row for row in rows if stored.get(row['user_id'], -1) < row['version']]
+        if not rows:
+            return
+        conn.execute(delete(self.table).where(or_(*(
+            and_(self.table.c.user_id == row['user_id'], self.table.c.version < row['version']) for row in rows
+        ))))
+        conn.execute(insert(self.table), rows)
+
+    def purge(self, ttl):
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                delete(self.table).where(self.table.c.update_time < datetime.now() - timedelta(seconds=ttl))
+            )
+        return result.rowcount
@@ -0,0 +1,64 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class PageCache:
+    # remembers the validators, content hash and outgoing links of every crawled
+    # url; entries of a crawl stay pending until its index is promoted, so a
+    # failed rebuild never marks pages as already indexed
+    def __init__(self, cache_path):
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS page_cache '
+            '(url TEXT PRIMARY KEY, source TEXT, etag TEXT, last_modified TEXT, content_hash TEXT, links TEXT)'
+        )
+        self.conn.commit()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT source, etag, last_modified, content_hash, links FROM page_cache WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        source, etag, last_modified, content_hash, links = row
+        return {
+            'source': source,
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'links': json.loads(links)
+        }
+
+    def record(self, url, source, etag, last_modified, content_hash, links):
+        with self.lock:
+            self.pending[url] = (url, source, etag, last_modified, content_hash, json.dumps(links))
+
+    def pending_rows(self):
+        with self.lock:
+            return list(self.pending.values())
+
+    def restore(self, rows):
+        with self.lock:
+            self.pending = {row[0]: tuple(row) for row in rows}
+
+    def commit(self):
+        with self.lock:
+            rows, self.pending = list(self.pending.values()), {}
+            self.conn.executemany('INSERT OR REPLACE INTO page_cache VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    def discard(self):
+        with self.lock:
+            self.pending = {}
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+            self.conn.execute('DELETE FROM page_cache')
+            self.conn.commit()
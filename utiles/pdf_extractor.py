@@ -0,0 +1,118 @@
+import zlib
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdf_text(path):
+    # runs in a worker process, so a broken file only costs its own text
+    try:
+        reader = PdfReader(path)
+        return '\n\n'.join(page.extract_text() or '' for page in reader.pages).strip()
+    except Exception as e:
+        print(f"解析 PDF 失敗 {path}: {e}")
+        return ''
+
+
+class AttachmentExtractor:
+    # text is cached per file hash, so a PDF is parsed once no matter how often
+    # the index is rebuilt, and only the unseen files are sent to the process pool
+    def __init__(self, cache_path, max_workers=4):
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS attachment_cache (key TEXT PRIMARY KEY, text BLOB)')
+        self.conn.commit()
+
+    def lookup(self, keys):
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, text FROM attachment_cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, text in rows:
+                    found[key] = zlib.decompress(text).decode('utf-8')
+        return found
+
+    def store(self, items):
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO attachment_cache (key, text) VALUES (?, ?)',
+                [(key, zlib.compress(text.encode('utf-8'))) for key, text in items]
+            )
+            self.conn.commit()
+
+    def extract_many(self, paths):
+        keys = {}
+        for path in paths:
+            if Path(path).suffix.lower() == '.pdf' and Path(path).is_file():
+                keys[path] = file_hash(path)
+        texts = self.lookup(set(keys.values()))
+
+        missing = {}
+        for path, key in keys.items():
+            if key not in texts:
+                missing.setdefault(key, path)
+
+        if missing:
+            items = list(zip(missing, self.map(extract_pdf_text, missing.values())))
+            self.store(items)
+            texts.update(items)
+
+        with self.lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return {path: texts[key] for path, key in keys.items()}
+
+    def map(self, func, items):
+        # one pool serves every call; its workers are spawned, a child forked from
+        # the threaded server could inherit a lock another thread held and hang on it
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            executor = self.executor
+        try:
+            return list(executor.map(func, items))
+        except BrokenProcessPool:
+            with self.executor_lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def extract(self, path):
+        return self.extract_many([path]).get(path, '')
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,91 @@
+import time
+import threading
+from queue import Queue
+
+_DONE = object()
+
+
+class Batcher:
+    # a batch is released when it is full, or once its oldest item has waited
+    # max_delay seconds so a slow trickle of items still reaches the next stage
+    def __init__(self, batch_size, max_delay=None):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.batch = []
+        self.started = 0
+
+    def __call__(self, item):
+        if not self.batch:
+            self.started = time.monotonic()
+        self.batch.append(item)
+        expired = self.max_delay is not None and time.monotonic() - self.started >= self.max_delay
+        if len(self.batch) < self.batch_size and not expired:
+            return []
+        batch, self.batch = self.batch, []
+        return [batch]
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        return [batch] if batch else []
+
+
+def run_pipeline(source, stages, maxsize=32):
+    # source(emit) pushes items into the first stage; every stage runs in its own
+    # thread, maps one item to an iterable of items and is connected to the next
+    # stage by a bounded queue so a slow stage applies back-pressure upstream
+    queues = [Queue(maxsize=maxsize) for _ in stages]
+    errors = []
+
+    def run_stage(position, stage):
+        inbox = queues[position]
+        outbox = queues[position + 1] if position + 1 < len(queues) else None
+
+        def forward(results):
+            for result in results or ():
+                if outbox is not None:
+                    outbox.put(result)
+
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            if errors:
+                continue
+            try:
+                forward(stage(item))
+            except Exception as e:
+                errors.append(e)
+
+        flush = getattr(stage, 'flush', None)
+        if flush and not errors:
+            try:
+                forward(flush())
+            except Exception as e:
+                errors.append(e)
+        if outbox is not None:
+            outbox.put(_DONE)
+
+    threads = [
+        threading.Thread(target=run_stage, args=(position, stage), daemon=True)
+        for position, stage in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+
+    def emit(item):
+        if errors:
+            raise errors[0]
+        queues[0].put(item)
+
+    try:
+        source(emit)
+    except Exception as e:
+        if not errors:
+            errors.append(e)
+    finally:
+        queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
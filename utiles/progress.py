@@ -0,0 +1,64 @@
+import time
+import threading
+from collections import defaultdict
+
+
+class CrawlProgress:
+    # live counters of one crawl; every pipeline thread and the crawler report
+    # into it and the status endpoint reads a snapshot at any time
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.stage_seconds = defaultdict(float)
+        self.started = time.monotonic()
+        self.crawl_started = None
+        self.crawl_finished = None
+        self.lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+
+    def timed(self, stage, func):
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.add_time(stage, time.perf_counter() - start)
+        return wrapper
+
+    def start_crawl(self):
+        self.crawl_started = time.monotonic()
+
+    def finish_crawl(self):
+        self.crawl_finished = time.monotonic()
+
+    def snapshot(self, embedding_stats=None):
+        with self.lock:
+            counters = dict(self.counters)
+            stages = dict(self.stage_seconds)
+        if self.crawl_started is not None:
+            stages['crawl'] = (self.crawl_finished or time.monotonic()) - self.crawl_started
+        if embedding_stats is not None:
+            # embedding time is spent inside the index stage, report it separately
+            stages['embed'] = embedding_stats['seconds']
+            stages['index'] = max(stages.get('index', 0.0) - embedding_stats['seconds'], 0.0)
+
+        crawl_seconds = stages.get('crawl') or 0.0
+        elapsed = time.monotonic() - self.started
+        snapshot = {
+            **{name: counters.get(name, 0) for name in (
+                'queued', 'fetched', 'failed', 'skipped', 'unchanged', 'bytes', 'chunks', 'duplicates', 'indexed'
+            )},
+            'elapsed_seconds': round(elapsed, 3),
+            'pages_per_second': round(counters.get('fetched', 0) / crawl_seconds, 3) if crawl_seconds else 0.0,
+            'bytes_per_second': round(counters.get('bytes', 0) / crawl_seconds, 3) if crawl_seconds else 0.0,
+            'stage_seconds': {stage: round(seconds, 3) for stage, seconds in stages.items()},
+        }
+        if embedding_stats is not None:
+            snapshot['embeddings'] = {'cached': embedding_stats['hits'], 'computed': embedding_stats['misses']}
+        return snapshot